@@ -0,0 +1,148 @@
+import asyncio
+import re
+import time
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+PLACEHOLDER = re.compile(r'\?')
+
+
+'''
+async_target(database_path)
+    returns the async driver and its target for a SQLAlchemy database
+    URL: ('sqlite', file path) or ('postgresql', asyncpg DSN)
+'''
+def async_target(database_path):
+    scheme, _, rest = database_path.partition('://')
+    dialect = scheme.split('+')[0]
+    if dialect == 'sqlite':
+        path = rest[1:] if rest.startswith('/') else rest
+        if not path or path == ':memory:':
+            raise ValueError('the async database needs a SQLite file, not an in-memory database')
+        return 'sqlite', path
+    if dialect in ('postgres', 'postgresql'):
+        return 'postgresql', 'postgresql://' + rest
+    raise ValueError(f'no async driver for {dialect!r} databases')
+
+
+'''
+SQLitePool
+    up to `size` aiosqlite connections, opened on demand
+'''
+class SQLitePool:
+
+    def __init__(self, path, size):
+        if aiosqlite is None:
+            raise RuntimeError('serving a SQLite database with the ASGI app needs aiosqlite: pip install aiosqlite')
+        self.path = path
+        self.size = size
+        self._idle = None
+        self._opened = []
+        self._count = 0
+
+    async def fetch(self, statement, parameters):
+        connection = await self._acquire()
+        try:
+            async with connection.execute(statement, parameters) as cursor:
+                return await cursor.fetchall()
+        finally:
+            self._idle.put_nowait(connection)
+
+    async def close(self):
+        for connection in self._opened:
+            await connection.close()
+        self._opened = []
+        self._idle = None
+        self._count = 0
+
+    async def _acquire(self):
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        if self._idle.empty() and self._count < self.size:
+            # count the connection before it is opened, other requests run meanwhile
+            self._count += 1
+            try:
+                connection = await aiosqlite.connect(self.path, isolation_level=None)
+            except Exception:
+                self._count -= 1
+                raise
+            self._opened.append(connection)
+            return connection
+        return await self._idle.get()
+
+
+'''
+PostgreSQLPool
+    an asyncpg pool of up to `size` connections, created on first use
+'''
+class PostgreSQLPool:
+
+    def __init__(self, dsn, size):
+        if asyncpg is None:
+            raise RuntimeError('serving a PostgreSQL database with the ASGI app needs asyncpg: pip install asyncpg')
+        self.dsn = dsn
+        self.size = size
+        self._pool = None
+        self._lock = None
+
+    async def fetch(self, statement, parameters):
+        if self._pool is None:
+            await self._connect()
+        # asyncpg numbers its placeholders
+        numbers = iter(range(1, len(parameters) + 1))
+        statement = PLACEHOLDER.sub(lambda match: f'${next(numbers)}', statement)
+        async with self._pool.acquire() as connection:
+            return [tuple(row) for row in await connection.fetch(statement, *parameters)]
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _connect(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._pool is None:
+                self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.size)
+
+
+'''
+AsyncDatabase
+    the database of the ASGI app, through aiosqlite for SQLite files and
+    asyncpg for PostgreSQL. Statements use `?` placeholders and run in
+    autocommit mode; on_statement(statement, seconds) is called after
+    each of them.
+'''
+class AsyncDatabase:
+
+    def __init__(self, database_path, pool_size=5, on_statement=None):
+        self.dialect, target = async_target(database_path)
+        self.on_statement = on_statement
+        if self.dialect == 'sqlite':
+            self._pool = SQLitePool(target, pool_size)
+        else:
+            self._pool = PostgreSQLPool(target, pool_size)
+
+    async def fetch(self, statement, *parameters):
+        '''Returns the rows of the statement as tuples.'''
+        start = time.perf_counter()
+        rows = await self._pool.fetch(statement, parameters)
+        if self.on_statement is not None:
+            self.on_statement(statement, time.perf_counter() - start)
+        return rows
+
+    async def fetchone(self, statement, *parameters):
+        rows = await self.fetch(statement, *parameters)
+        return rows[0] if rows else None
+
+    async def close(self):
+        await self._pool.close()
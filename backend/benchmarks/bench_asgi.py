@@ -0,0 +1,89 @@
+'''
+Concurrent-request throughput of the ASGI app served by uvicorn next to
+the WSGI app served by the threaded Werkzeug server, for the routes of
+the async handlers and for a route passed to the Flask app.
+
+    python -m benchmarks.bench_asgi --size 10000 --concurrency 1 8 32
+'''
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+
+from benchmarks.common import make_app, drop_app, percentile
+from benchmarks.run import SCENARIOS, ServerDriver, run_scenario
+from flaskr.asgi import ASGIApp
+
+BENCH_SCENARIOS = [
+    'GET /categories',
+    'GET /questions',
+    'GET /questions?after=<last>',
+    'GET /categories/<id>/questions',
+    'POST /quizzes',
+    'POST /questions/search substring',
+]
+
+
+class UvicornDriver(ServerDriver):
+
+    def __init__(self, app):
+        import uvicorn
+
+        sock = socket.socket()
+        # accepted connections inherit it: uvicorn writes the head and the body of a response separately
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.bind(('127.0.0.1', 0))
+        self.asgi_app = ASGIApp(app)
+        self.server = uvicorn.Server(uvicorn.Config(self.asgi_app, log_level='warning', lifespan='on'))
+        self.thread = threading.Thread(target=self.server.run, kwargs={'sockets': [sock]}, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        self.port = sock.getsockname()[1]
+        self.local = threading.local()
+
+    def close(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--repeat', type=int, default=500, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per scenario')
+    parser.add_argument('--database-url', default=None, help='scratch database to use instead of a SQLite file')
+    args = parser.parse_args()
+
+    scenarios = [scenario for scenario in SCENARIOS if scenario['name'] in BENCH_SCENARIOS]
+    results = {}
+    app = make_app(args.size, database_url=args.database_url)
+    try:
+        for name, driver_class in [('wsgi', ServerDriver), ('asgi', UvicornDriver)]:
+            driver = driver_class(app)
+            try:
+                for concurrency in args.concurrency:
+                    for scenario in scenarios:
+                        samples, elapsed, statuses = run_scenario(driver, scenario, {'size': args.size},
+                                                                  args.repeat, args.warmup, concurrency)
+                        result = results.setdefault(scenario['name'], {}).setdefault(str(concurrency), {})
+                        result[name] = {
+                            'rps': round(len(samples) / elapsed, 1),
+                            'p50_ms': round(percentile(samples, 50) * 1000, 3),
+                            'p99_ms': round(percentile(samples, 99) * 1000, 3),
+                            'statuses': statuses,
+                        }
+                        print(f'{name} {concurrency:>3} {scenario["name"]:<40} {result[name]}', file=sys.stderr)
+            finally:
+                driver.close()
+    finally:
+        drop_app(app)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
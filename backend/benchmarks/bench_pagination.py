@@ -0,0 +1,45 @@
+'''
+Latency of the paginated question listings as the question bank grows.
+
+With the page window pushed into SQL the numbers should stay roughly
+flat across sizes instead of growing with the table. The last page is
+fetched both by page number (OFFSET) and by cursor (keyset) to compare
+the cost of deep pages.
+'''
+import argparse
+import json
+
+from benchmarks.common import make_app, drop_app, measure, summarize
+from flaskr import encode_cursor, QUESTIONS_PER_PAGE
+
+ENDPOINTS = [
+    ('GET /questions?page=1', lambda client, size: client.get('/questions?page=1')),
+    ('GET /questions?page=50', lambda client, size: client.get('/questions?page=50')),
+    ('GET /questions?page=<last>', lambda client, size: client.get(
+        f'/questions?page={size // QUESTIONS_PER_PAGE}')),
+    ('GET /questions?after=<last>', lambda client, size: client.get(
+        f'/questions?after={encode_cursor(size - QUESTIONS_PER_PAGE)}')),
+    ('GET /categories/1/questions', lambda client, size: client.get('/categories/1/questions')),
+    ('POST /questions/search', lambda client, size: client.post('/questions/search', json={'searchTerm': 'title'})),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        app = make_app(size)
+        client = app.test_client()
+        results[size] = {name: summarize(measure(lambda: call(client, size), args.repeat))
+                         for name, call in ENDPOINTS}
+        drop_app(app)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
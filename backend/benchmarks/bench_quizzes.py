@@ -0,0 +1,46 @@
+'''
+Latency of a quiz step (POST /quizzes) as the question bank grows, for
+all categories and for one category, with an empty and with a long
+previous_questions list, and of a round of 10 questions fetched in one
+request.
+'''
+import argparse
+import json
+
+from benchmarks.common import make_app, drop_app, measure, summarize
+
+
+def quiz(category_id, previous_questions, **options):
+    return lambda client: client.post('/quizzes', json=dict({
+        'previous_questions': previous_questions,
+        'quiz_category': {'type': 'click', 'id': category_id},
+    }, **options))
+
+ENDPOINTS = [
+    ('POST /quizzes all', quiz(0, [])),
+    ('POST /quizzes category', quiz(1, [])),
+    ('POST /quizzes category, 50 previous', quiz(1, list(range(1, 51)))),
+    ('POST /quizzes category, count 10', quiz(1, [], count=10)),
+    ('POST /quizzes category, count 10, difficulty', quiz(1, [], count=10, difficulty=3)),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        app = make_app(size)
+        client = app.test_client()
+        results[size] = {name: summarize(measure(lambda: call(client), args.repeat))
+                         for name, call in ENDPOINTS}
+        drop_app(app)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
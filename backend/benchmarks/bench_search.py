@@ -0,0 +1,41 @@
+'''
+Latency of POST /questions/search per match mode as the question bank
+grows: the substring mode scans the table with ILIKE while the word and
+prefix modes are answered from the token index.
+'''
+import argparse
+import json
+
+from benchmarks.common import make_app, drop_app, measure, summarize
+
+
+def search(term, match):
+    return lambda client: client.post('/questions/search', json={'searchTerm': term, 'match': match})
+
+ENDPOINTS = [
+    ('substring "title"', search('title', 'substring')),
+    ('word "title"', search('title', 'word')),
+    ('prefix "tit"', search('tit', 'prefix')),
+    ('word "river king"', search('river king', 'word')),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        app = make_app(size)
+        client = app.test_client()
+        results[size] = {name: summarize(measure(lambda: call(client), args.repeat))
+                         for name, call in ENDPOINTS}
+        drop_app(app)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+'''
+Cold start of a worker per DATABASE_STARTUP mode: every sample is a fresh
+Python process that imports the app, calls create_app and serves a first
+GET /categories, against a seeded SQLite file whose schema is current.
+'''
+import argparse
+import json
+import subprocess
+import sys
+
+from benchmarks.common import make_app, drop_app, summarize
+
+STARTUP_MODES = ['lazy', 'upgrade', 'skip']
+
+WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+from flaskr import create_app
+imported = time.perf_counter()
+app = create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[1], 'DATABASE_STARTUP': sys.argv[2]})
+created = time.perf_counter()
+app.test_client().get('/categories')
+served = time.perf_counter()
+print(json.dumps([imported - start, created - imported, served - created]))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = make_app(args.size)
+    database_url = app.config['SQLALCHEMY_DATABASE_URI']
+    results = {}
+    try:
+        for mode in STARTUP_MODES:
+            samples = [json.loads(subprocess.check_output([sys.executable, '-c', WORKER, database_url, mode]))
+                       for _ in range(args.repeat)]
+            results[mode] = {
+                name: summarize(sorted(sample[index] for sample in samples))
+                for index, name in enumerate(['import', 'create_app', 'first request'])
+            }
+    finally:
+        drop_app(app)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+'''
+Latency of substring searches (POST /questions/search) as the question
+bank grows, with the ILIKE table scan next to the trigram index.
+'''
+import argparse
+import json
+
+from benchmarks.common import make_app, drop_app, measure, summarize
+
+
+def search(term):
+    return lambda client: client.post('/questions/search', json={'searchTerm': term})
+
+ENDPOINTS = [
+    ('"itl" (common)', search('itl')),
+    ('"ver kin" (rare)', search('ver kin')),
+    ('"zebra" (absent)', search('zebra')),
+]
+
+MODES = [
+    ('ilike', {'SEARCH_TRIGRAM_INDEX': False}),
+    ('trigram', {'SEARCH_TRIGRAM_INDEX': True}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        results[size] = {}
+        for mode, config in MODES:
+            app = make_app(size, config=config)
+            client = app.test_client()
+            for name, call in ENDPOINTS:
+                results[size][f'{mode} {name}'] = summarize(measure(lambda: call(client), args.repeat))
+            drop_app(app)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
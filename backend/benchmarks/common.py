@@ -0,0 +1,104 @@
+'''
+Shared helpers for the trivia API benchmarks.
+
+The benchmarks run offline: every run seeds a throwaway SQLite database
+(or a scratch database given by URL) with a synthetic question bank and
+drives the app through the Flask test client. Run them from the backend
+folder, e.g.
+
+    python -m benchmarks.bench_pagination
+    python -m benchmarks.run --sizes 1000 100000 --output results.json
+'''
+import os
+import random
+import tempfile
+import time
+
+from flaskr import create_app
+from models import db, Question, Category
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+WORDS = ['movie', 'title', 'river', 'painter', 'world', 'cup', 'organ', 'lake',
+         'palace', 'oscar', 'artist', 'team', 'country', 'city', 'blood', 'king']
+
+
+def make_app(size, seed=0, batch_size=10000, config=None, database_url=None):
+    '''
+    Creates an app bound to a fresh SQLite file holding `size` questions
+    spread over the six default categories. `config` is added to the
+    test config of the app, which applies the migrations at startup
+    and doesn't cache responses unless DATABASE_STARTUP or
+    RESPONSE_CACHE_BACKEND are given. When database_url is given that database is
+    used instead: it must be a scratch database, its tables are emptied.
+    '''
+    if database_url is None:
+        fd, path = tempfile.mkstemp(prefix='trivia_bench_', suffix='.db')
+        os.close(fd)
+        database_url = 'sqlite:///' + path
+    else:
+        path = None
+    app = create_app(dict({'DATABASE_STARTUP': 'upgrade', 'RESPONSE_CACHE_BACKEND': 'none'}, **(config or {}), SQLALCHEMY_DATABASE_URI=database_url))
+    app.config['BENCH_DATABASE_FILE'] = path
+
+    rng = random.Random(seed)
+    with app.app_context():
+        if path is None:
+            empty_tables()
+        db.session.execute(Category.__table__.insert(), [{'type': type} for type in CATEGORIES])
+        for start in range(0, size, batch_size):
+            rows = [{
+                'question': ' '.join(rng.choice(WORDS) for _ in range(8)) + '?',
+                'answer': rng.choice(WORDS),
+                'category': rng.randint(1, len(CATEGORIES)),
+                'difficulty': rng.randint(1, 5),
+            } for _ in range(start, min(start + batch_size, size))]
+            db.session.execute(Question.__table__.insert(), rows)
+        db.session.commit()
+    return app
+
+
+def empty_tables():
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute('TRUNCATE questions, categories RESTART IDENTITY')
+    else:
+        db.session.execute(Question.__table__.delete())
+        db.session.execute(Category.__table__.delete())
+    db.session.commit()
+
+
+def drop_app(app):
+    with app.app_context():
+        db.session.remove()
+        db.get_engine(app).dispose()
+    if app.config['BENCH_DATABASE_FILE']:
+        os.remove(app.config['BENCH_DATABASE_FILE'])
+
+
+def measure(fn, repeat=50, warmup=3):
+    '''
+    Calls fn() `repeat` times after a short warmup and returns the
+    sorted list of wall-clock durations in seconds.
+    '''
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return sorted(samples)
+
+
+def percentile(samples, p):
+    '''Nearest-rank percentile of an already sorted list of samples.'''
+    if not samples:
+        return None
+    index = max(0, min(len(samples) - 1, int(round(p / 100.0 * len(samples))) - 1))
+    return samples[index]
+
+
+def summarize(samples):
+    return {
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+    }
@@ -0,0 +1,38 @@
+'''
+Compares two reports of benchmarks.run, scenario by scenario:
+
+    python -m benchmarks.compare before.json after.json
+'''
+import argparse
+import json
+
+METRICS = ('p50_ms', 'p99_ms', 'rps', 'peak_kib')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+
+    print(f'before: {before.get("commit")}  after: {after.get("commit")}')
+    for size, results in after['results'].items():
+        print(f'\n{size} questions')
+        for name, result in results.items():
+            previous = before['results'].get(size, {}).get(name)
+            if previous is None:
+                continue
+            changes = []
+            for metric in METRICS:
+                if metric in result and previous.get(metric):
+                    changes.append(f'{metric} {previous[metric]} -> {result[metric]} ({result[metric] / previous[metric]:.2f}x)')
+            print(f'  {name:<45} ' + '  '.join(changes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+'''
+Benchmark suite for every trivia endpoint.
+
+For each dataset size it seeds a database, drives every scenario through
+the Flask test client (or a threaded WSGI server with --server) and
+reports p50/p99 latency, requests per second and the peak Python memory
+allocated while serving the scenario. The JSON report records the git
+commit so runs can be compared with benchmarks.compare.
+
+    python -m benchmarks.run --sizes 1000 100000 1000000 --output results.json
+'''
+import argparse
+import http.client
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks.common import make_app, drop_app, percentile
+from flaskr import encode_cursor, QUESTIONS_PER_PAGE
+
+NEW_QUESTION = {'question': 'Benchmark question?', 'answer': 'Benchmark', 'category': 1, 'difficulty': 1}
+
+
+'''
+Drivers send one request and return its status code and body.
+'''
+class TestClientDriver:
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+    def close(self):
+        pass
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class ServerDriver:
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.port = self.server.server_port
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def close(self):
+        self.server.shutdown()
+
+
+'''
+Scenarios: name, method, path and body of the i-th request. Paths and
+bodies are functions of the request number and of a shared state dict,
+so write scenarios can create questions that later scenarios delete.
+'''
+def scenario(name, method, path, body=None, setup=None):
+    return {
+        'name': name,
+        'method': method,
+        'path': path if callable(path) else (lambda i, state: path),
+        'body': body if callable(body) or body is None else (lambda i, state: body),
+        'setup': setup,
+    }
+
+
+def start_quiz_session(driver, state):
+    _, data = driver.request('POST', '/quizzes/sessions', {'quiz_category': {'type': 'Science', 'id': 1}})
+    state['session_id'] = json.loads(data)['session_id']
+
+
+def create_questions(driver, state, count):
+    state['created'] = []
+    for _ in range(count):
+        _, data = driver.request('POST', '/questions?response=lean', NEW_QUESTION)
+        state['created'].append(json.loads(data)['created'])
+
+
+SCENARIOS = [
+    scenario('GET /categories', 'GET', '/categories'),
+    scenario('GET /stats', 'GET', '/stats'),
+    scenario('GET /questions', 'GET', '/questions'),
+    scenario('GET /questions?page=<last>', 'GET', lambda i, state: f'/questions?page={state["size"] // QUESTIONS_PER_PAGE}'),
+    scenario('GET /questions?after=<last>', 'GET',
+             lambda i, state: f'/questions?after={encode_cursor(state["size"] - QUESTIONS_PER_PAGE)}'),
+    scenario('GET /categories/<id>/questions', 'GET', lambda i, state: f'/categories/{i % 6 + 1}/questions'),
+    scenario('POST /questions/search substring', 'POST', '/questions/search', {'searchTerm': 'itl'}),
+    scenario('POST /questions/search word', 'POST', '/questions/search', {'searchTerm': 'title', 'match': 'word'}),
+    scenario('POST /questions/search prefix', 'POST', '/questions/search', {'searchTerm': 'tit', 'match': 'prefix'}),
+    scenario('POST /quizzes', 'POST', '/quizzes',
+             lambda i, state: {'previous_questions': list(range(1, 21)), 'quiz_category': {'type': 'Science', 'id': 1}}),
+    scenario('POST /quizzes count=10', 'POST', '/quizzes',
+             {'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': 1}, 'count': 10}),
+    scenario('POST /quizzes/sessions', 'POST', '/quizzes/sessions', {'quiz_category': {'type': 'Science', 'id': 1}}),
+    scenario('POST /quizzes/sessions/<id>/next', 'POST', lambda i, state: f'/quizzes/sessions/{state["session_id"]}/next',
+             setup=start_quiz_session),
+    scenario('POST /questions', 'POST', '/questions', NEW_QUESTION),
+    scenario('POST /questions?response=lean', 'POST', '/questions?response=lean', NEW_QUESTION),
+    scenario('DELETE /questions/<id>?response=lean', 'DELETE',
+             lambda i, state: f'/questions/{state["created"][i]}?response=lean',
+             setup=lambda driver, state: create_questions(driver, state, state['requests'])),
+    scenario('GET /questions/export (1000 rows)', 'GET', '/questions/export?min_id=1&max_id=1000'),
+    scenario('GET /pool', 'GET', '/pool'),
+    scenario('GET /metrics', 'GET', '/metrics'),
+]
+
+
+def run_scenario(driver, scenario, state, repeat, warmup, concurrency):
+    '''
+    Sends warmup + repeat requests and returns the latency samples of the
+    last repeat ones, the wall-clock time they took and their statuses.
+    '''
+    state['requests'] = warmup + repeat
+    if scenario['setup'] is not None:
+        scenario['setup'](driver, state)
+
+    def send(i):
+        body = scenario['body'](i, state) if scenario['body'] is not None else None
+        start = time.perf_counter()
+        status, _ = driver.request(scenario['method'], scenario['path'](i, state), body)
+        return time.perf_counter() - start, status
+
+    for i in range(warmup):
+        send(i)
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(send, range(warmup, warmup + repeat)))
+    else:
+        results = [send(i) for i in range(warmup, warmup + repeat)]
+    elapsed = time.perf_counter() - start
+
+    return sorted(seconds for seconds, _ in results), elapsed, sorted({status for _, status in results})
+
+
+def peak_memory(driver, scenario, state, requests):
+    '''Peak Python memory allocated while serving `requests` requests, in KiB.'''
+    tracemalloc.start()
+    try:
+        run_scenario(driver, scenario, state, requests, 0, 1)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--repeat', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests per scenario')
+    parser.add_argument('--memory-requests', type=int, default=5, help='requests traced for peak memory, 0 to skip')
+    parser.add_argument('--server', action='store_true', help='serve the app with a threaded WSGI server')
+    parser.add_argument('--concurrency', type=int, default=1, help='concurrent clients (with --server)')
+    parser.add_argument('--database-url', default=None, help='scratch database to use instead of SQLite files')
+    parser.add_argument('--only', nargs='+', default=None, help='run the scenarios whose name contains one of these')
+    parser.add_argument('--output', default=None, help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if args.concurrency > 1 and not args.server:
+        parser.error('--concurrency needs --server')
+
+    scenarios = [s for s in SCENARIOS if not args.only or any(part in s['name'] for part in args.only)]
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'driver': 'server' if args.server else 'test_client',
+        'concurrency': args.concurrency,
+        'repeat': args.repeat,
+        'results': {},
+    }
+
+    for size in args.sizes:
+        app = make_app(size, database_url=args.database_url)
+        driver = ServerDriver(app) if args.server else TestClientDriver(app)
+        results = report['results'][str(size)] = {}
+        try:
+            for scenario in scenarios:
+                state = {'size': size}
+                samples, elapsed, statuses = run_scenario(driver, scenario, state, args.repeat, args.warmup, args.concurrency)
+                results[scenario['name']] = {
+                    'p50_ms': round(percentile(samples, 50) * 1000, 3),
+                    'p99_ms': round(percentile(samples, 99) * 1000, 3),
+                    'rps': round(len(samples) / elapsed, 1),
+                    'statuses': statuses,
+                }
+                if args.memory_requests and not args.server:
+                    results[scenario['name']]['peak_kib'] = peak_memory(driver, scenario, {'size': size}, args.memory_requests)
+                print(f'{size:>9} {scenario["name"]:<45} {results[scenario["name"]]}', file=sys.stderr)
+        finally:
+            driver.close()
+            drop_app(app)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+import csv
+import io
+import json
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, bump_question_version, Question, get_category_cache, notify_questions_changed
+from serialization import QUESTION_FIELDS, dumps, question_query
+
+BULK_FORMATS = ('jsonl', 'csv')
+EXPORT_FORMATS = ('ndjson', 'csv')
+MAX_REPORTED_ERRORS = 1000
+
+
+def read_rows(lines, format):
+    '''
+    Yields (row number, row) for every row of JSON Lines or CSV input,
+    where the row is None when it can't be parsed. Rows are numbered
+    from 1; blank JSON lines are skipped but counted. Malformed CSV ends
+    the input.
+    '''
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        number = 0
+        try:
+            for number, row in enumerate(reader, start=1):
+                yield number, row
+        except csv.Error:
+            yield number + 1, None
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def parse_integer(value):
+    '''
+    Returns the integer of a JSON number or a CSV text, None when it isn't
+    one: booleans and numbers with a fraction aren't.
+    '''
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            return None
+    return None
+
+
+def validate_row(row, category_ids):
+    '''
+    Returns the column values of a question row and None, or None and the
+    reason the row is invalid. Category and difficulty default to 1 as in
+    POST /questions when they are missing or empty.
+    '''
+    if not isinstance(row, dict):
+        return None, 'row is not a valid object'
+
+    question = row.get('question')
+    answer = row.get('answer')
+    if not isinstance(question, str) or not question.strip():
+        return None, 'question is required'
+    if not isinstance(answer, str) or not answer.strip():
+        return None, 'answer is required'
+
+    values = {}
+    for name in ('category', 'difficulty'):
+        value = row.get(name)
+        values[name] = 1 if value is None or value == '' else parse_integer(value)
+        if values[name] is None:
+            return None, f'{name} must be an integer'
+    category, difficulty = values['category'], values['difficulty']
+
+    if category not in category_ids:
+        return None, f'unknown category {category}'
+    if not 1 <= difficulty <= 5:
+        return None, 'difficulty must be between 1 and 5'
+
+    return {
+        'question': question,
+        'answer': answer,
+        'category': category,
+        'difficulty': difficulty
+    }, None
+
+
+def import_questions(lines, format='jsonl', batch_size=1000):
+    '''
+    Validates and inserts the questions read from JSON Lines or CSV
+    input, batch_size rows per INSERT (executemany) and commit. Invalid
+    rows are reported and skipped. When a batch fails in the database its
+    rows are retried one by one so only the failing rows are lost.
+    Returns a report with the number of inserted and failed rows and the
+    first MAX_REPORTED_ERRORS errors.
+    '''
+    categories, _ = get_category_cache().get()
+    report = {'inserted': 0, 'failed': 0, 'errors': []}
+
+    def fail(number, error):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'row': number, 'error': error})
+
+    def insert(batch):
+        try:
+            db.session.execute(Question.__table__.insert(), [values for _, values in batch])
+            bump_question_version()
+            db.session.commit()
+            report['inserted'] += len(batch)
+            return
+        except SQLAlchemyError:
+            db.session.rollback()
+
+        for number, values in batch:
+            try:
+                db.session.execute(Question.__table__.insert(), values)
+                bump_question_version()
+                db.session.commit()
+                report['inserted'] += 1
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                fail(number, str(getattr(e, 'orig', e)))
+
+    batch = []
+    try:
+        for number, row in read_rows(lines, format):
+            values, error = validate_row(row, categories)
+            if error:
+                fail(number, error)
+                continue
+
+            batch.append((number, values))
+            if len(batch) >= batch_size:
+                insert(batch)
+                batch = []
+
+        if batch:
+            insert(batch)
+    finally:
+        if report['inserted']:
+            notify_questions_changed()
+
+    return report
+
+
+def export_questions(format='ndjson', category=None, min_id=None, max_id=None, chunk_size=1000,
+                     fields=QUESTION_FIELDS):
+    '''
+    Yields the questions as NDJSON lines or CSV text, in id order, chunk_size
+    rows at a time. The rows are read through a server-side cursor
+    (stream_results) as plain tuples, so memory stays constant whatever
+    the size of the table. category, min_id and max_id (inclusive) filter
+    the rows, which lets several workers export disjoint shards. fields
+    are the columns to export.
+    '''
+    selection = question_query(fields)
+    if category is not None:
+        selection = selection.filter(Question.category == category)
+    if min_id is not None:
+        selection = selection.filter(Question.id >= min_id)
+    if max_id is not None:
+        selection = selection.filter(Question.id <= max_id)
+    rows = selection.order_by(Question.id).execution_options(stream_results=True).yield_per(chunk_size)
+
+    buffer = io.StringIO()
+    if format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(dumps(dict(zip(fields, row)), sort_keys=False).decode())
+            buffer.write('\n')
+
+    count = 0
+    for row in rows:
+        write(row)
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
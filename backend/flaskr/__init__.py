@@ -1,43 +1,333 @@
 import os, sys
+import base64
+import json
+import math
+from bisect import bisect_right
 
-from flask import Flask, request, abort, jsonify
+import click
+from flask import Flask, Response, current_app, g, request, abort, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, select
 from flask_cors import CORS
 import random
 
-from models import db, setup_db, Question, Category
+from models import db, setup_db, ensure_schema, database_path, get_category_cache, pool_status, Question, QuestionCounter
+from migrations import LATEST_VERSION, current_version, upgrade
+from bulk import BULK_FORMATS, EXPORT_FORMATS, import_questions, export_questions, parse_integer
+from search import SEARCH_MODES, QuestionSearch
+from snapshot import QuestionSnapshot
+from serialization import QUESTION_FIELDS, dumps, format_row, format_rows, parse_fields, question_query
+from .metrics import Metrics
+from .quiz_sessions import create_quiz_session_store
+from .response_cache import ALL_CATEGORIES, ResponseCache, category_generation, create_backend
+from .compression import create_compression
+from .rate_limits import client_key, create_load_shedder, create_rate_limiter
 
 QUESTIONS_PER_PAGE = 10
+WRITE_RESPONSE_MODES = ('full', 'lean')
+# POST routes that only read, with a read-only session like GET requests
+READ_ONLY_POSTS = ('/questions/search', '/quizzes')
+
+'''
+Cursors are opaque tokens handed out as `next_cursor` and sent back as the
+`after` request argument. They encode the id of the last question seen.
+'''
+def encode_cursor(question_id):
+    return base64.urlsafe_b64encode(f'id:{question_id}'.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        prefix, question_id = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+        if prefix != 'id':
+            raise ValueError(token)
+        return int(question_id)
+    except ValueError:
+        return None
+
+def quiz_options(body, max_count):
+    '''
+    Returns the count, difficulty and seed of a POST /quizzes body. The
+    count is None when a single question is asked for. Raises ValueError
+    on a bad value, like a boolean or a number with a fraction.
+    '''
+    count = body.get('count', None)
+    difficulty = body.get('difficulty', None)
+    seed = body.get('seed', None)
+    if count is not None:
+        count = parse_integer(count)
+        if count is None or not 1 <= count <= max_count:
+            raise ValueError(f'count must be an integer between 1 and {max_count}')
+    if difficulty is not None:
+        difficulty = parse_integer(difficulty)
+        if difficulty is None:
+            raise ValueError('difficulty must be an integer')
+    if seed is not None and type(seed) not in (int, str):
+        raise ValueError('seed must be an integer or a string')
+    return count, difficulty, seed
+
+def json_response(data, status=200):
+    '''
+    Same as jsonify, through the encoder of serialization.dumps: for the
+    responses listing questions.
+    '''
+    body = dumps(data, sort_keys=current_app.config['JSON_SORT_KEYS']) + b'\n'
+    return current_app.response_class(body, status=status, mimetype=current_app.config['JSONIFY_MIMETYPE'])
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path))
+
+    quiz_sessions = create_quiz_session_store(app.config)
+
+    question_search = QuestionSearch(
+        include_answers=app.config.get('SEARCH_INCLUDE_ANSWERS', False),
+        use_trigrams=app.config.get('SEARCH_TRIGRAM_INDEX', True),
+        check_seconds=app.config.get('SEARCH_INDEX_CHECK_SECONDS', 5))
+    app.extensions.setdefault('question_listeners', []).append(question_search)
+    app.extensions['question_search'] = question_search
+
+    question_snapshot = None
+    if app.config.get('QUESTION_SNAPSHOT', False):
+        question_snapshot = QuestionSnapshot(check_seconds=app.config.get('QUESTION_SNAPSHOT_CHECK_SECONDS', 5))
+        app.extensions['question_listeners'].append(question_snapshot)
+    app.extensions['question_snapshot'] = question_snapshot
+
+    question_counter = QuestionCounter(check_seconds=app.config.get('QUESTION_COUNT_CHECK_SECONDS', 5))
+    app.extensions['question_listeners'].append(question_counter)
+    app.extensions['question_counter'] = question_counter
+
+    response_cache = ResponseCache(create_backend(app.config))
+    app.extensions['question_listeners'].append(response_cache)
+    app.extensions['response_cache'] = response_cache
+
+
+    compression = create_compression(app.config)
+    app.extensions['compression'] = compression
     
     '''
     @DONE: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
     '''
     CORS()
     cors = CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+    '''
+    Request and SQL metrics per route, exported on /metrics.
+    '''
+    metrics = Metrics(slow_query_seconds=app.config.get('SLOW_QUERY_SECONDS'))
+    metrics.register(response_cache.requests)
+    app.extensions['metrics'] = metrics
+
+    '''
+    Per-client rate limits of the routes in RATE_LIMITS, and a cap on the
+    requests of the expensive routes running at once: both turn requests
+    away before they reach the database, with 429 and 503.
+    '''
+    rate_limiter = create_rate_limiter(app.config)
+    metrics.register(rate_limiter.rejected)
+    app.extensions['rate_limiter'] = rate_limiter
+    load_shedder = create_load_shedder(app.config)
+    metrics.register(load_shedder.shed)
+    app.extensions['load_shedder'] = load_shedder
+    client_header = app.config.get('RATE_LIMIT_CLIENT_HEADER')
+    trusted_proxies = app.config.get('RATE_LIMIT_TRUSTED_PROXIES', 1)
+
+    '''
+    Every request is a unit of work on its own session, created on first
+    use: requests that only read get a read-only session, served by the
+    read replicas when there are any, and the session is rolled back if
+    the request failed and removed when it ends.
+    '''
+    @app.before_request
+    def before_request():
+        metrics.start_request()
+        rule = request.url_rule.rule if request.url_rule is not None else None
+        # CORS preflights are answered without spending the client's tokens
+        # or a slot, a browser would report a turned away one as a failed request
+        limited = request.method != 'OPTIONS'
+        # the ASGI app checks the rate limits of its routes before passing requests on
+        if limited and rate_limiter.limits_route(rule) and not request.environ.get('trivia.rate_limited'):
+            forwarded_for = request.headers.get(client_header) if client_header else None
+            g.retry_after = rate_limiter.check(rule, client_key(request.remote_addr, forwarded_for, trusted_proxies))
+            if g.retry_after:
+                abort(429)
+        if limited and load_shedder.covers(rule):
+            if not load_shedder.acquire(rule):
+                abort(503)
+            g.load_shed_slot = True
+
+        ensure_schema()
+        if request.method in ('GET', 'HEAD') or (
+                request.url_rule is not None and request.url_rule.rule in READ_ONLY_POSTS):
+            g.read_only_session = {'use_replica': app.extensions['replicas'] is not None}
+
+    @app.teardown_request
+    def teardown_request(error):
+        if g.pop('load_shed_slot', False):
+            load_shedder.release()
+        g.pop('read_only_session', None)
+        if error is not None and db.session.registry.has():
+            db.session.rollback()
+        db.session.remove()
+
     '''
     @DONE: Use the after_request decorator to set Access-Control-Allow
+    GET responses that aren't streamed also get an ETag and are answered
+    with 304 when the client has it already. Large responses are
+    compressed.
     '''
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Origin', '*')
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
         response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PATCH, DELETE, OPTIONS')
+        if request.method == 'GET' and response.status_code == 200 and not response.is_streamed:
+            if response.get_etag()[0] is None:
+                response.add_etag()
+            response.make_conditional(request)
+        compression.apply(request, response)
+        metrics.finish_request(request, response)
         return response
 
-    def paginate_questions(request, selection):
-        page = request.args.get('page', 1, type=int)
-        start =  (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
-
-        questions = [question.format() for question in selection]
-        current_questions = questions[start:end]
-
-        return current_questions
+    def get_cursor(request):
+        '''
+        Returns the question id encoded in the `after` request argument,
+        None when the argument is missing. Aborts with 400 on a bad token.
+        '''
+        token = request.args.get('after', None)
+        if token is None:
+            return None
+
+        after = decode_cursor(token)
+        if after is None:
+            abort(400)
+        return after
+
+    def get_fields(request):
+        '''
+        Returns the question fields of the `fields` request argument, all
+        of them when it is missing. Aborts with 400 on an unknown field.
+        '''
+        try:
+            return parse_fields(request.args.get('fields', None))
+        except ValueError:
+            abort(400)
+
+    def paginate_questions(request, selection, after=None, fields=QUESTION_FIELDS):
+        '''
+        Runs the page window of the selection query of question fields
+        (see serialization.question_query) in SQL (LIMIT/OFFSET)
+        and counts the whole selection with a separate COUNT(*), so only
+        the rows of the requested page are loaded and formatted.
+        When `after` is given the page is the keyset window
+        `WHERE id > after ORDER BY id LIMIT n` instead, which costs the same
+        at any depth. The selection must be ordered by Question.id.
+        Returns the formatted page, the total number of questions and the
+        cursor of the next page (None on the last page).
+        '''
+        total_questions = selection.order_by(None).count()
+
+        if after is not None:
+            questions = selection.filter(Question.id > after).limit(QUESTIONS_PER_PAGE + 1).all()
+            has_more = len(questions) > QUESTIONS_PER_PAGE
+            questions = questions[:QUESTIONS_PER_PAGE]
+        else:
+            page = request.args.get('page', 1, type=int)
+            start =  (page - 1) * QUESTIONS_PER_PAGE
+            if page < 1 or start >= total_questions:
+                return [], total_questions, None
+
+            questions = selection.offset(start).limit(QUESTIONS_PER_PAGE).all()
+            has_more = start + len(questions) < total_questions
+
+        current_questions = format_rows(questions, fields)
+        next_cursor = encode_cursor(questions[-1].id) if has_more else None
+
+        return current_questions, total_questions, next_cursor
+
+    def get_write_response_mode(request):
+        '''
+        Returns the `response` request argument of POST and DELETE
+        requests: `full` adds the current page of questions to the
+        response, `lean` returns only the id and the total number of
+        questions. Aborts with 400 on an unknown mode.
+        '''
+        mode = request.args.get('response', app.config.get('WRITE_RESPONSE_MODE', 'full'))
+        if mode not in WRITE_RESPONSE_MODES:
+            abort(400)
+        return mode
+
+    def paginate_question_ids(request, question_ids, after=None, fields=QUESTION_FIELDS):
+        '''
+        Same as paginate_questions for a sorted list of question ids that
+        is already in memory: only the rows of the page are loaded.
+        '''
+        total_questions = len(question_ids)
+
+        if after is not None:
+            start = bisect_right(question_ids, after)
+        else:
+            page = request.args.get('page', 1, type=int)
+            start =  (page - 1) * QUESTIONS_PER_PAGE
+            if page < 1 or start >= total_questions:
+                return [], total_questions, None
+
+        page_ids = question_ids[start:start + QUESTIONS_PER_PAGE]
+        questions = question_query(fields).filter(Question.id.in_(page_ids)).order_by(Question.id).all()
+        current_questions = format_rows(questions, fields)
+        has_more = start + len(page_ids) < total_questions
+        next_cursor = encode_cursor(page_ids[-1]) if has_more else None
+
+        return current_questions, total_questions, next_cursor
+
+    def paginate_snapshot(request, category, after=None, fields=QUESTION_FIELDS):
+        '''
+        Same as paginate_questions for the questions of a category (all
+        questions when None), read from the question snapshot.
+        '''
+        arrays = question_snapshot.arrays()
+        page_ids, total_questions, has_more = arrays.page(
+            category, after, request.args.get('page', 1, type=int), QUESTIONS_PER_PAGE)
+        current_questions = format_rows(arrays.rows(page_ids, fields), fields)
+        next_cursor = encode_cursor(page_ids[-1]) if has_more else None
+
+        return current_questions, total_questions, next_cursor
+
+    def sample_questions(selection, count, rng=random):
+        '''
+        Samples up to `count` distinct questions of the selection query of
+        question fields uniformly, without loading the candidates: counts
+        them with COUNT(*) and draws distinct offsets into them in id order
+        with rng. A single question is read at its offset, several in one
+        query that numbers the ids of the candidates with ROW_NUMBER() and
+        keeps those at the offsets, a single pass over the index whatever
+        the count. When rows were deleted in between and nothing is left
+        at the offsets, the first questions are taken instead. Returns the
+        rows in the order they were drawn.
+        '''
+        total_questions = selection.order_by(None).count()
+        offsets = rng.sample(range(total_questions), min(count, total_questions))
+        if not offsets:
+            return []
+
+        if len(offsets) == 1:
+            rows = selection.order_by(Question.id).offset(offsets[0]).limit(1).all()
+        else:
+            numbered = select([Question.id, (func.row_number().over(order_by=Question.id) - 1).label('position')])
+            if selection.whereclause is not None:
+                numbered = numbered.where(selection.whereclause)
+            numbered = numbered.alias('numbered')
+            drawn = select([numbered.c.id]).where(numbered.c.position.in_(offsets))
+            rows = selection.filter(Question.id.in_(drawn)).order_by(Question.id).all()
+        if not rows:
+            return selection.order_by(Question.id).limit(len(offsets)).all()
+        if len(rows) != len(offsets):
+            # rows were deleted between the count and the fetch
+            return rows
+        rank = {offset: index for index, offset in enumerate(sorted(offsets))}
+        return [rows[rank[offset]] for offset in offsets]
 
     '''
     @DONE: 
@@ -46,9 +336,40 @@ def create_app(test_config=None):
     '''
     @app.route('/categories')
     def get_categories():
-      categories = Category.query.all()
-      categories_formatted = {category.id:category.type for category in categories}
-      return categories_formatted
+      categories_formatted, etag = get_category_cache().get()
+      response = jsonify(categories_formatted)
+      response.set_etag(etag)
+      return response.make_conditional(request)
+
+    '''
+    Question counts per category and per difficulty, served from the
+    question counter: no question is read. Questions without a known
+    category or a difficulty only count in the total.
+    '''
+    @app.route('/stats')
+    def get_stats():
+        categories_formatted, _ = get_category_cache().get()
+        categories = {category_id: {"type": type, "total_questions": 0, "difficulties": {}}
+                      for category_id, type in categories_formatted.items()}
+        difficulties = {}
+        total_questions = 0
+
+        for (category, difficulty), count in question_counter.counts().items():
+            total_questions += count
+            if difficulty is not None:
+                difficulties[difficulty] = difficulties.get(difficulty, 0) + count
+            if category in categories:
+                category_stats = categories[category]
+                category_stats["total_questions"] += count
+                if difficulty is not None:
+                    category_stats["difficulties"][difficulty] = count
+
+        return jsonify({
+            "success": True,
+            "total_questions": total_questions,
+            "categories": categories,
+            "difficulties": difficulties
+        })
 
     '''
     @DONE: 
@@ -63,20 +384,26 @@ def create_app(test_config=None):
     Clicking on the page numbers should update the questions. 
     '''
     @app.route('/questions',  methods=['GET'])
+    @response_cache.cached(lambda: [ALL_CATEGORIES], vary=lambda: get_category_cache().get()[1])
     def get_questions():
-        selection = Question.query.order_by(Question.id).all()
-        current_selection = paginate_questions(request, selection)
+        after = get_cursor(request)
+        fields = get_fields(request)
+        if question_snapshot is not None:
+            current_selection, total_questions, next_cursor = paginate_snapshot(request, None, after, fields)
+        else:
+            selection = question_query(fields).order_by(Question.id)
+            current_selection, total_questions, next_cursor = paginate_questions(request, selection, after, fields)
 
-        categories = Category.query.all()
-        categories_formatted = {category.id:category.type for category in categories}
+        categories_formatted, _ = get_category_cache().get()
 
         if len(current_selection) == 0:
             abort(404)
           
-        return jsonify({
+        return json_response({
             "success": True,
             "questions": current_selection,
-            "total_questions": len(selection),
+            "total_questions": total_questions,
+            "next_cursor": next_cursor,
             "current_category": None,
             "categories": categories_formatted
         })
@@ -89,29 +416,37 @@ def create_app(test_config=None):
     '''
     @app.route('/questions/<int:question_id>',  methods=['DELETE'])
     def delete_question(question_id):
-        question = Question.query.filter(Question.id == question_id).one_or_none()
-        if question is None:
-            abort(404)
+        mode = get_write_response_mode(request)
+        fields = get_fields(request)
 
         try:
-            question.delete()
-            selection = Question.query.order_by(Question.id).all()
-            current_selection = paginate_questions(request, selection)
-            return jsonify({
-                "success": True,
-                "deleted": question.id,
-                "questions": current_selection,
-                "total_questions": len(selection),
-                "current_category": None,
-            })
+            question = Question.delete_by_id(question_id)
+            if question is None:
+                abort_code = 404
+            elif mode == 'lean':
+                return jsonify({
+                    "success": True,
+                    "deleted": question.id,
+                    "total_questions": question_counter.total(),
+                })
+            else:
+                selection = question_query(fields).order_by(Question.id)
+                current_selection, total_questions, _ = paginate_questions(request, selection, fields=fields)
+                return json_response({
+                    "success": True,
+                    "deleted": question.id,
+                    "questions": current_selection,
+                    "total_questions": total_questions,
+                    "current_category": None,
+                })
 
-        except exception as e:
-            error = true
+        except Exception as e:
+            error = True
             print(sys.exc_info())
             print(e)
             abort(422)
-        finally:
-            db.session.close()
+
+        abort(abort_code)
 
     '''
     @DONE: 
@@ -131,27 +466,88 @@ def create_app(test_config=None):
         answer = body.get("answer", None)
         category = int(body.get("category", "1"))
         difficulty = int(body.get("difficulty", "1"))
+        mode = get_write_response_mode(request)
+        fields = get_fields(request)
 
         try:
             question = Question(question=question, answer=answer, category=category, difficulty=difficulty)
             question.insert()
+            if mode == 'lean':
+                return jsonify({
+                    "success": True,
+                    "created": question.id,
+                    "total_questions": question_counter.total(),
+                })
 
-            selection = Question.query.order_by(Question.id).all()
-            current_selection = paginate_questions(request, selection)
+            selection = question_query(fields).order_by(Question.id)
+            current_selection, total_questions, _ = paginate_questions(request, selection, fields=fields)
 
-            return jsonify({
+            return json_response({
                 "success": True,
                 "created": question.id,
                 "questions": current_selection,
-                "total_questions": len(selection),
+                "total_questions": total_questions,
           })
 
-        except exception as e:
-            error = true
+        except Exception as e:
+            error = True
             print(sys.exc_info())
             print(e)
             abort(422)
 
+    '''
+    Bulk import: POST /questions/bulk and the `flask import-questions`
+    command stream JSON Lines or CSV rows into batched inserts and report
+    the rows that could not be imported.
+    '''
+    @app.route('/questions/bulk',  methods=['POST'])
+    def bulk_add_questions():
+        format = request.args.get('format', 'csv' if request.mimetype == 'text/csv' else 'jsonl')
+        batch_size = request.args.get('batch_size', app.config.get('BULK_BATCH_SIZE', 1000), type=int)
+        if format not in BULK_FORMATS or batch_size < 1:
+            abort(400)
+
+        lines = (line.decode('utf-8', 'replace') for line in request.stream)
+        report = import_questions(lines, format, batch_size)
+
+        return jsonify({
+            "success": True,
+            "inserted": report['inserted'],
+            "failed": report['failed'],
+            "errors": report['errors']
+        })
+
+    @app.cli.command('import-questions')
+    @click.argument('file', type=click.File('r', encoding='utf-8'))
+    @click.option('--format', type=click.Choice(BULK_FORMATS), default=None,
+                  help='Input format, guessed from the file extension by default.')
+    @click.option('--batch-size', default=1000, help='Rows per INSERT and commit.')
+    def import_questions_command(file, format, batch_size):
+        '''Imports questions from a JSON Lines or CSV file ("-" for stdin).'''
+        if format is None:
+            format = 'csv' if file.name.endswith('.csv') else 'jsonl'
+
+        ensure_schema()
+        report = import_questions(file, format, batch_size)
+        click.echo(json.dumps(report, indent=2))
+
+    @app.route('/questions/export',  methods=['GET'])
+    def export_all_questions():
+        format = request.args.get('format', 'ndjson')
+        if format not in EXPORT_FORMATS:
+            abort(400)
+
+        rows = export_questions(
+            format,
+            fields=get_fields(request),
+            category=request.args.get('category', None, type=int),
+            min_id=request.args.get('min_id', None, type=int),
+            max_id=request.args.get('max_id', None, type=int),
+            chunk_size=app.config.get('EXPORT_CHUNK_SIZE', 1000))
+        mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+
+        return Response(stream_with_context(rows), mimetype=mimetype)
+
     '''
     @DONE: 
     Create a POST endpoint to get questions based on a search term. 
@@ -167,20 +563,41 @@ def create_app(test_config=None):
       
         body = request.get_json()
         term = body.get('searchTerm', None)
+        match = body.get('match', app.config.get('SEARCH_MATCH_MODE', 'substring'))
+        after = get_cursor(request)
+        fields = get_fields(request)
 
-        try:
-            selection = Question.query.filter(Question.question.ilike(f'%{term}%')).order_by(Question.id).all()
-            current_selection = paginate_questions(request, selection)
+        # ranked results are paginated by page number only
+        if match not in SEARCH_MODES or (match != 'substring' and after is not None):
+            abort(400)
 
-            return jsonify({
+        try:
+            if match == 'substring':
+                question_ids = question_search.substring_ids(term)
+                if question_ids is None:
+                    selection = question_query(fields).filter(Question.question.ilike(f'%{term}%')).order_by(Question.id)
+                    current_selection, total_questions, next_cursor = paginate_questions(request, selection, after, fields)
+                else:
+                    current_selection, total_questions, next_cursor = paginate_question_ids(
+                        request, question_ids, after, fields)
+            else:
+                page = request.args.get('page', 1, type=int)
+                start = (page - 1) * QUESTIONS_PER_PAGE
+                questions, total_questions = question_search.search(
+                    term, match, max(start, 0), QUESTIONS_PER_PAGE, fields)
+                current_selection = format_rows(questions, fields) if page >= 1 else []
+                next_cursor = None
+
+            return json_response({
                 "success": True,
                 "questions": current_selection,
-                "total_questions": len(selection),
+                "total_questions": total_questions,
+                "next_cursor": next_cursor,
                 "current_category": None,
           })
 
-        except exception as e:
-            error = true
+        except Exception as e:
+            error = True
             print(sys.exc_info())
             print(e)
             abort(422)
@@ -194,10 +611,17 @@ def create_app(test_config=None):
     category to be shown. 
     '''
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+    @response_cache.cached(lambda category_id: [category_generation(category_id)])
     def get_questions_per_category(category_id):
+        after = get_cursor(request)
+        fields = get_fields(request)
         try:
-            selection = Question.query.filter(Question.category == category_id).order_by(Question.id).all()
-            current_selection = paginate_questions(request, selection)
+            if question_snapshot is not None:
+                current_selection, total_questions, next_cursor = paginate_snapshot(request, category_id, after, fields)
+            else:
+                selection = question_query(fields).filter(Question.category == category_id).order_by(Question.id)
+                current_selection, total_questions, next_cursor = paginate_questions(
+                    request, selection, after, fields)
 
             if len(current_selection) == 0:
                 abort_code = 404
@@ -205,20 +629,19 @@ def create_app(test_config=None):
                 abort_code = None
 
             if abort_code is None:
-                return jsonify({
+                return json_response({
                 "success": True,
                 "questions": current_selection,
-                "total_questions": len(selection),
+                "total_questions": total_questions,
+                "next_cursor": next_cursor,
                 "current_category": None,
                 })
 
-        except exception as e:
-            error = true
+        except Exception as e:
+            error = True
             print(sys.exc_info())
             print(e)
             abort(422)
-        finally:
-            db.session.close()
         
         if abort_code:
             abort(abort_code)
@@ -241,30 +664,44 @@ def create_app(test_config=None):
         previous_questions = body.get('previous_questions', [])            
         quiz_category = body.get('quiz_category', {'id': "0", 'type': "click"})
         quiz_category_id = int(quiz_category['id'])
+        fields = get_fields(request)
+        try:
+            count, difficulty, seed = quiz_options(body, app.config.get('QUIZ_MAX_COUNT', 50))
+        except (TypeError, ValueError):
+            abort(400)
+        rng = random.Random(seed) if seed is not None else random
 
         try:
-            if quiz_category_id > 0:
-                if len(previous_questions) == 0:
-                    selection = Question.query.filter(Question.category == quiz_category_id).order_by(Question.id).all()
-                else:
-                    selection = Question.query.filter(Question.category == quiz_category_id, Question.id.notin_(previous_questions)).order_by(Question.id).all()
+            if question_snapshot is not None and all(type(id) is int for id in previous_questions):
+                arrays = question_snapshot.arrays()
+                question_ids = arrays.sample(quiz_category_id if quiz_category_id > 0 else None, difficulty,
+                                             previous_questions, count or 1, rng)
+                questions = arrays.rows(question_ids, fields)
             else:
-                if len(previous_questions) == 0:
-                    selection = Question.query.order_by(Question.id).all()
-                else:
-                    selection = Question.query.filter(Question.id.notin_(previous_questions)).order_by(Question.id).all()
+                selection = question_query(fields)
+                if quiz_category_id > 0:
+                    selection = selection.filter(Question.category == quiz_category_id)
+                if difficulty is not None:
+                    selection = selection.filter(Question.difficulty == difficulty)
+                if len(previous_questions) > 0:
+                    selection = selection.filter(Question.id.notin_(previous_questions))
+                questions = sample_questions(selection, count or 1, rng)
+
+            if count is not None:
+                return json_response({
+                    "success": True,
+                    "questions": format_rows(questions, fields)
+                })
 
-            if len(selection) == 0:
+            if len(questions) == 0:
                 return jsonify({
                     "success": True,
                     "question": None
                     })
 
-            random_question = random.choice(selection).format()
-
-            return jsonify({
+            return json_response({
               "success": True,
-              "question": random_question
+              "question": format_row(questions[0], fields)
             })
 
         except Exception as e:
@@ -273,6 +710,112 @@ def create_app(test_config=None):
             print(e)
             abort(422)
 
+    '''
+    Quiz sessions: the server keeps the shuffled question ids of a quiz so
+    clients don't have to send previous_questions on every round. A
+    session holds up to QUIZ_SESSION_MAX_LENGTH questions drawn at random,
+    so its size doesn't grow with the question bank.
+    POST /quizzes/sessions starts a session for a category and
+    POST /quizzes/sessions/<session_id>/next returns its next question.
+    '''
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        body = request.get_json()
+
+        quiz_category = body.get('quiz_category', {'id': "0", 'type': "click"})
+        quiz_category_id = int(quiz_category['id'])
+
+        length = app.config.get('QUIZ_SESSION_MAX_LENGTH', 500)
+        try:
+            if question_snapshot is not None:
+                question_ids = question_snapshot.arrays().sample(
+                    quiz_category_id if quiz_category_id > 0 else None, None, (), length)
+            else:
+                selection = db.session.query(Question.id)
+                if quiz_category_id > 0:
+                    selection = selection.filter(Question.category == quiz_category_id)
+                question_ids = [question_id for question_id, in sample_questions(selection, length)]
+
+        except Exception as e:
+            print(sys.exc_info())
+            print(e)
+            abort(422)
+
+        session_id = quiz_sessions.start(question_ids)
+
+        return jsonify({
+            "success": True,
+            "session_id": session_id,
+            "total_questions": len(question_ids)
+        })
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_quiz_session_question(session_id):
+        fields = get_fields(request)
+        while True:
+            try:
+                question_id = quiz_sessions.next_id(session_id)
+            except KeyError:
+                abort(404)
+
+            if question_id is None:
+                return jsonify({
+                    "success": True,
+                    "question": None
+                    })
+
+            # skip questions deleted since the session started
+            question = question_query(fields).filter(Question.id == question_id).first()
+            if question is not None:
+                return json_response({
+                    "success": True,
+                    "question": format_row(question, fields)
+                })
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def end_quiz_session(session_id):
+        if not quiz_sessions.end(session_id):
+            abort(404)
+
+        return jsonify({
+            "success": True,
+            "deleted": session_id
+        })
+
+    '''
+    Schema migrations: `flask db-upgrade` applies the missing migrations and
+    `flask db-version` shows the version of the database.
+    '''
+    @app.cli.command('db-upgrade')
+    @click.option('--to', 'target', type=int, default=None, help='Version to upgrade to, the latest by default.')
+    def db_upgrade_command(target):
+        '''Applies the missing schema migrations.'''
+        applied = upgrade(db.engine, target)
+        click.echo(f'applied {applied}' if applied else 'nothing to apply')
+        click.echo(f'database at version {current_version(db.engine)} of {LATEST_VERSION}')
+
+    @app.cli.command('db-version')
+    def db_version_command():
+        '''Shows the schema version of the database.'''
+        click.echo(f'database at version {current_version(db.engine)} of {LATEST_VERSION}')
+
+    '''
+    Returns the state of the database connection pool of this process,
+    to size the pool and the number of workers.
+    '''
+    @app.route('/pool', methods=['GET'])
+    def get_pool_status():
+        replicas = app.extensions['replicas']
+        return jsonify({
+            "success": True,
+            "pool": pool_status(db.engine),
+            "replicas": replicas.status() if replicas is not None else []
+        })
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(metrics.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
     '''
     @TODO: 
     Create error handlers for all expected errors 
@@ -303,6 +846,26 @@ def create_app(test_config=None):
             "message": "unprocessable"
         }), 422 
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        response = jsonify({
+            "success": False,
+            "error": 429,
+            "message": "too many requests"
+        })
+        response.headers['Retry-After'] = str(math.ceil(g.get('retry_after', 1)))
+        return response, 429
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        response = jsonify({
+            "success": False,
+            "error": 503,
+            "message": "service unavailable"
+        })
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
     @app.errorhandler(500)
     def internal_error(error):
         return jsonify({
@@ -0,0 +1,635 @@
+'''
+ASGI entry point of the trivia API, e.g.
+
+    uvicorn --factory flaskr.asgi:create_asgi_app
+
+The read routes of the quiz traffic (ASGIApp.routes) are served by async
+handlers on an async database driver, aiosqlite for SQLite files and
+asyncpg for PostgreSQL, so one worker keeps serving requests while others
+wait on the database. Every other request goes to the Flask app in a
+worker thread: the writes, so the in-process question listeners see them,
+the routes with in-process state, and any request the async handlers
+can't answer exactly like the Flask view (malformed input, database
+errors). Both share the category cache, the response cache and the
+metrics of the Flask app. With read replicas configured, the async
+handlers read from them like the read routes of the Flask app do.
+'''
+import asyncio
+import io
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from urllib.parse import parse_qsl
+
+from async_database import AsyncDatabase
+from models import ensure_schema, get_setting
+from serialization import dumps, format_row, format_rows, parse_fields
+
+from . import create_app, decode_cursor, encode_cursor, quiz_options, QUESTIONS_PER_PAGE
+from .rate_limits import client_key
+from .response_cache import ALL_CATEGORIES, category_generation
+
+ERROR_MESSAGES = {400: 'bad request', 404: 'resource not found', 422: 'unprocessable', 429: 'too many requests',
+                  500: 'internal server error', 503: 'service unavailable'}
+
+# chunks of a streamed Flask response buffered ahead of the client
+WSGI_BUFFERED_CHUNKS = 8
+
+# [statements, seconds] spent in SQL by the async handler of the current request
+request_sql = ContextVar('request_sql', default=None)
+
+# the AsyncDatabase the async handler of the current request reads from
+request_database = ContextVar('request_database', default=None)
+
+
+class Delegate(Exception):
+    '''Raised by an async handler to pass its request to the Flask app.'''
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate.strip('"') == etag:
+            return True
+    return False
+
+
+'''
+Request
+    the parts of an ASGI HTTP request the async handlers read
+'''
+class Request:
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.client = (scope.get('client') or ('', 0))[0]
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.body = body
+        self.args = parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+
+    def arg(self, name, default=None, type=None):
+        '''The first value of a query argument, like request.args.get.'''
+        for key, value in self.args:
+            if key == name:
+                if type is None:
+                    return value
+                try:
+                    return type(value)
+                except ValueError:
+                    return default
+        return default
+
+    def get_json(self):
+        mimetype = self.headers.get('content-type', '').split(';')[0].strip().lower()
+        if mimetype != 'application/json' and not (mimetype.startswith('application/') and mimetype.endswith('+json')):
+            raise Delegate()
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            raise Delegate()
+
+
+def wsgi_environ(scope, body):
+    '''Builds the WSGI environ of an ASGI HTTP request.'''
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]) if server[1] is not None else '80',
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        # the rate limit of the request was checked already
+        'trivia.rate_limited': scope.get('trivia.rate_limited', False),
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+
+'''
+ASGIApp
+    serves a Flask app created by create_app over ASGI
+'''
+class ASGIApp:
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.metrics = flask_app.extensions['metrics']
+        self.response_cache = flask_app.extensions['response_cache']
+        self.compression = flask_app.extensions['compression']
+        self.rate_limiter = flask_app.extensions['rate_limiter']
+        self.load_shedder = flask_app.extensions['load_shedder']
+        self.question_snapshot = flask_app.extensions['question_snapshot']
+        pool_size = get_setting(flask_app.config, 'DATABASE_POOL_SIZE', int, 5)
+        self.database = AsyncDatabase(
+            flask_app.config['SQLALCHEMY_DATABASE_URI'], pool_size=pool_size, on_statement=self.observe_statement)
+        self.replicas = flask_app.extensions['replicas']
+        self.replica_databases = {}
+        if self.replicas is not None:
+            self.replica_databases = {
+                engine: AsyncDatabase(url, pool_size=pool_size, on_statement=self.observe_statement)
+                for url, engine in zip(self.replicas.urls, self.replicas.engines)}
+        self.executor = ThreadPoolExecutor(get_setting(flask_app.config, 'ASGI_THREADS', int, 32))
+        self.routes = [
+            ('GET', re.compile('/categories'), '/categories', self.get_categories),
+            ('GET', re.compile('/questions'), '/questions', self.get_questions),
+            ('GET', re.compile(r'/categories/(?P<category_id>\d+)/questions'),
+             '/categories/<int:category_id>/questions', self.get_questions_per_category),
+            ('POST', re.compile('/quizzes'), '/quizzes', self.play_quiz),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f'unsupported ASGI scope {scope["type"]!r}')
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        for method, pattern, rule, handler in self.routes:
+            match = pattern.fullmatch(scope['path'])
+            if method == scope['method'] and match is not None:
+                response = await self.handle(Request(scope, body), rule, handler, match.groupdict())
+                if response is not None:
+                    return await self.send_response(send, *response)
+                break
+
+        await self.call_flask(scope, body, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def close(self):
+        await self.database.close()
+        for database in self.replica_databases.values():
+            await database.close()
+        self.executor.shutdown(wait=False)
+
+    async def handle(self, request, rule, handler, params):
+        '''
+        Runs an async handler and records its metrics. Returns its
+        (status, headers, body), None when the Flask app has to answer.
+        Requests over their rate limit or shed under load are turned
+        away first, like the Flask app does.
+        '''
+        start = time.perf_counter()
+        if self.rate_limiter.limits_route(rule):
+            wait = await self.check_rate_limit(request, rule)
+            if wait:
+                return self.turn_away(request, rule, 429, wait, start)
+        slot = self.load_shedder.covers(rule)
+        if slot and not self.load_shedder.acquire(rule):
+            return self.turn_away(request, rule, 503, 1, start)
+        try:
+            return await self.run_handler(request, rule, handler, params)
+        finally:
+            if slot:
+                self.load_shedder.release()
+
+    async def check_rate_limit(self, request, rule):
+        '''Same as the rate limit check of the Flask app, returns the seconds to wait.'''
+        config = self.flask_app.config
+        header = config.get('RATE_LIMIT_CLIENT_HEADER')
+        client = client_key(request.client, request.headers.get(header.lower()) if header else None,
+                            config.get('RATE_LIMIT_TRUSTED_PROXIES', 1))
+        request.scope['trivia.rate_limited'] = True
+        if self.rate_limiter.backend.blocking:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.rate_limiter.check, rule, client)
+        return self.rate_limiter.check(rule, client)
+
+    def turn_away(self, request, rule, status, retry_after, start):
+        status, headers, body = self.error(status)
+        headers = headers + [('Retry-After', str(math.ceil(retry_after)))]
+        self.metrics.observe_request(request.method, rule, status, time.perf_counter() - start, 0, 0.0)
+        return status, self.cors_headers(request) + headers, body
+
+    async def run_handler(self, request, rule, handler, params):
+        if not self.flask_app.extensions['schema']['ready']:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.ensure_schema)
+
+        start = time.perf_counter()
+        sql = [0, 0.0]
+        token = request_sql.set(sql)
+        database_token = request_database.set(self.choose_database())
+        try:
+            status, headers, body = await handler(request, **{name: int(value) for name, value in params.items()})
+        except Delegate:
+            return None
+        except Exception:
+            self.flask_app.logger.debug('%s %s passed to the Flask app', request.method, request.path, exc_info=True)
+            return None
+        finally:
+            request_sql.reset(token)
+            request_database.reset(database_token)
+
+        status, headers, body = self.after_request(request, status, headers, body)
+        self.metrics.observe_request(request.method, rule, status, time.perf_counter() - start, sql[0], sql[1])
+        return status, self.cors_headers(request) + headers, body
+
+    def after_request(self, request, status, headers, body):
+        '''Same as the after_request hook of the Flask app, but for the CORS headers.'''
+        mimetype = next((value.split(';')[0].strip() for name, value in headers if name == 'Content-Type'), None)
+        if not self.compression.eligible(status, mimetype, len(body)):
+            return status, headers, body
+        headers = headers + [('Vary', 'Accept-Encoding')]
+        encoding = self.compression.negotiate(request.headers.get('accept-encoding'))
+        if encoding is None:
+            return status, headers, body
+
+        headers = [(name, 'W/' + value if name == 'ETag' and not value.startswith('W/') else value)
+                   for name, value in headers]
+        return status, headers + [('Content-Encoding', encoding)], self.compression.compress(body, encoding)
+
+    def choose_database(self):
+        '''The database of the next healthy read replica, the primary one when there is none.'''
+        if self.replicas is None:
+            return self.database
+        if self.replicas.due():
+            # the health checks block, run them off the event loop
+            self.executor.submit(self.replicas.check_due)
+        engine = self.replicas.choose(check=False)
+        return self.database if engine is None else self.replica_databases[engine]
+
+    @property
+    def read_database(self):
+        return request_database.get() or self.database
+
+    def ensure_schema(self):
+        with self.flask_app.app_context():
+            ensure_schema()
+
+    def load_snapshot(self):
+        with self.flask_app.app_context():
+            return self.question_snapshot.arrays()
+
+    def observe_statement(self, statement, seconds):
+        sql = request_sql.get()
+        if sql is not None:
+            sql[0] += 1
+            sql[1] += seconds
+        self.metrics.check_slow_query(statement, seconds, self.flask_app.logger)
+
+    def cors_headers(self, request):
+        # the headers of Flask-CORS and of the after_request hook
+        headers = []
+        origin = request.headers.get('origin')
+        if origin is not None:
+            headers += [('Access-Control-Allow-Origin', origin), ('Access-Control-Allow-Credentials', 'true'),
+                        ('Vary', 'Origin')]
+        return headers + [
+            ('Access-Control-Allow-Origin', '*'),
+            ('Access-Control-Allow-Headers', 'Content-Type, Authorization'),
+            ('Access-Control-Allow-Methods', 'GET, POST, PATCH, DELETE, OPTIONS'),
+        ]
+
+    def json(self, data, status=200, headers=()):
+        body = dumps(data, sort_keys=self.flask_app.config['JSON_SORT_KEYS']) + b'\n'
+        return status, [('Content-Type', 'application/json')] + list(headers), body
+
+    def error(self, status):
+        return self.json({"success": False, "error": status, "message": ERROR_MESSAGES[status]}, status)
+
+    async def send_response(self, send, status, headers, body):
+        if status != 304:
+            headers = headers + [('Content-Length', str(len(body)))]
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def call_flask(self, scope, body, send):
+        '''
+        Runs the Flask app in a worker thread. The response is iterated in
+        that thread too, since streamed responses need the request context
+        pushed there, and handed over with a bounded number of chunks in
+        flight. A client that goes away stops the iteration.
+        '''
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        space = threading.Semaphore(WSGI_BUFFERED_CHUNKS)
+        closed = threading.Event()
+
+        def put(kind, value):
+            while not space.acquire(timeout=1):
+                if closed.is_set():
+                    raise ConnectionError('client went away')
+            loop.call_soon_threadsafe(chunks.put_nowait, (kind, value))
+
+        def run():
+            started = {}
+
+            def start_response(status, headers, exc_info=None):
+                started['response'] = (int(status.split(' ', 1)[0]), headers)
+                return lambda data: put('body', data)
+
+            try:
+                iterable = self.flask_app(wsgi_environ(scope, body), start_response)
+                try:
+                    for chunk in iterable:
+                        if 'response' in started:
+                            put('start', started.pop('response'))
+                        if chunk:
+                            put('body', chunk)
+                        if closed.is_set():
+                            break
+                    if 'response' in started:
+                        put('start', started.pop('response'))
+                finally:
+                    if hasattr(iterable, 'close'):
+                        iterable.close()
+                put('end', None)
+            except BaseException as error:
+                loop.call_soon_threadsafe(chunks.put_nowait, ('error', error))
+
+        worker = loop.run_in_executor(self.executor, run)
+        try:
+            while True:
+                kind, value = await chunks.get()
+                space.release()
+                if kind == 'start':
+                    status, headers = value
+                    await send({
+                        'type': 'http.response.start',
+                        'status': status,
+                        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+                    })
+                elif kind == 'body':
+                    await send({'type': 'http.response.body', 'body': value, 'more_body': True})
+                elif kind == 'end':
+                    await send({'type': 'http.response.body', 'body': b''})
+                    break
+                else:
+                    raise value
+        finally:
+            closed.set()
+        await worker
+
+    '''
+    Async handlers, answering like the Flask views of the same routes.
+    '''
+    async def categories(self):
+        cache = self.flask_app.extensions['category_cache']
+        cached = cache.cached()
+        if cached is not None:
+            return cached
+        rows = await self.read_database.fetch('SELECT id, type FROM categories ORDER BY id')
+        return cache.store(dict(rows))
+
+    async def call_cache(self, method, *args):
+        # a network backend would block the event loop
+        if self.response_cache.backend.blocking:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
+        return method(*args)
+
+    async def cached(self, request, rule, view_args, generations, vary, handler):
+        '''Same as ResponseCache.cached, for an async handler.'''
+        if self.response_cache.backend is None:
+            return await handler(request, **view_args)
+
+        key = await self.call_cache(self.response_cache.key, rule, view_args, request.args, generations, vary)
+        entry = await self.call_cache(self.response_cache.get, rule, key)
+        if entry is None:
+            status, headers, body = await handler(request, **view_args)
+            if status != 200:
+                return status, headers, body
+            entry = await self.call_cache(self.response_cache.set, key, 'application/json', body)
+
+        etag, mimetype, body = entry
+        headers = [('ETag', f'"{etag}"')]
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return 304, headers, b''
+        return 200, [('Content-Type', mimetype)] + headers, body
+
+    def cursor(self, request):
+        token = request.arg('after')
+        if token is None:
+            return None
+        after = decode_cursor(token)
+        if after is None:
+            raise Delegate()
+        return after
+
+    def fields(self, request):
+        try:
+            return parse_fields(request.arg('fields'))
+        except ValueError:
+            raise Delegate()
+
+    async def snapshot(self):
+        '''The arrays of the question snapshot, None when it is disabled.'''
+        if self.question_snapshot is None:
+            return None
+        arrays = self.question_snapshot.cached()
+        if arrays is None:
+            arrays = await asyncio.get_running_loop().run_in_executor(self.executor, self.load_snapshot)
+        return arrays
+
+    def paginate_snapshot(self, request, arrays, category, after, fields):
+        '''Same as paginate_snapshot of the Flask app.'''
+        page_ids, total_questions, has_more = arrays.page(
+            category, after, request.arg('page', 1, type=int), QUESTIONS_PER_PAGE)
+        next_cursor = encode_cursor(page_ids[-1]) if has_more else None
+        return format_rows(arrays.rows(page_ids, fields), fields), total_questions, next_cursor
+
+    async def paginate(self, request, where, parameters, after, fields):
+        '''Same as paginate_questions, for the questions matching `where`.'''
+        total_questions, = await self.read_database.fetchone(f'SELECT COUNT(*) FROM questions{where}', *parameters)
+        columns = f'SELECT {", ".join(fields)} FROM questions'
+
+        if after is not None:
+            keyset = f'{where} AND id > ?' if where else ' WHERE id > ?'
+            rows = await self.read_database.fetch(f'{columns}{keyset} ORDER BY id LIMIT ?',
+                                                  *parameters, after, QUESTIONS_PER_PAGE + 1)
+            has_more = len(rows) > QUESTIONS_PER_PAGE
+            rows = rows[:QUESTIONS_PER_PAGE]
+        else:
+            page = request.arg('page', 1, type=int)
+            start = (page - 1) * QUESTIONS_PER_PAGE
+            if page < 1 or start >= total_questions:
+                return [], total_questions, None
+
+            rows = await self.read_database.fetch(f'{columns}{where} ORDER BY id LIMIT ? OFFSET ?',
+                                                  *parameters, QUESTIONS_PER_PAGE, start)
+            has_more = start + len(rows) < total_questions
+
+        next_cursor = encode_cursor(rows[-1][0]) if has_more else None
+        return format_rows(rows, fields), total_questions, next_cursor
+
+    async def get_categories(self, request):
+        categories, etag = await self.categories()
+        headers = [('ETag', f'"{etag}"')]
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return 304, headers, b''
+        return self.json(categories, headers=headers)
+
+    async def get_questions(self, request):
+        _, categories_etag = await self.categories()
+        return await self.cached(request, '/questions', {}, [ALL_CATEGORIES], categories_etag, self.list_questions)
+
+    async def list_questions(self, request):
+        arrays = await self.snapshot()
+        if arrays is not None:
+            current_selection, total_questions, next_cursor = self.paginate_snapshot(
+                request, arrays, None, self.cursor(request), self.fields(request))
+        else:
+            current_selection, total_questions, next_cursor = await self.paginate(
+                request, '', (), self.cursor(request), self.fields(request))
+        categories, _ = await self.categories()
+
+        if len(current_selection) == 0:
+            return self.error(404)
+
+        return self.json({
+            "success": True,
+            "questions": current_selection,
+            "total_questions": total_questions,
+            "next_cursor": next_cursor,
+            "current_category": None,
+            "categories": categories
+        })
+
+    async def get_questions_per_category(self, request, category_id):
+        return await self.cached(request, '/categories/<int:category_id>/questions', {'category_id': category_id},
+                                 [category_generation(category_id)], None, self.list_questions_per_category)
+
+    async def list_questions_per_category(self, request, category_id):
+        arrays = await self.snapshot()
+        if arrays is not None:
+            current_selection, total_questions, next_cursor = self.paginate_snapshot(
+                request, arrays, category_id, self.cursor(request), self.fields(request))
+        else:
+            current_selection, total_questions, next_cursor = await self.paginate(
+                request, ' WHERE category = ?', (category_id,), self.cursor(request), self.fields(request))
+
+        if len(current_selection) == 0:
+            return self.error(404)
+
+        return self.json({
+            "success": True,
+            "questions": current_selection,
+            "total_questions": total_questions,
+            "next_cursor": next_cursor,
+            "current_category": None,
+        })
+
+    async def play_quiz(self, request):
+        body = request.get_json()
+
+        previous_questions = body.get('previous_questions', [])
+        quiz_category = body.get('quiz_category', {'id': "0", 'type': "click"})
+        quiz_category_id = int(quiz_category['id'])
+        fields = self.fields(request)
+        if not isinstance(previous_questions, list) or not all(type(id) is int for id in previous_questions):
+            raise Delegate()
+
+        try:
+            count, difficulty, seed = quiz_options(body, self.flask_app.config.get('QUIZ_MAX_COUNT', 50))
+        except (TypeError, ValueError):
+            raise Delegate()
+        rng = random.Random(seed) if seed is not None else random
+
+        arrays = await self.snapshot()
+        if arrays is not None:
+            question_ids = arrays.sample(quiz_category_id if quiz_category_id > 0 else None, difficulty,
+                                         previous_questions, count or 1, rng)
+            questions = arrays.rows(question_ids, fields)
+        else:
+            questions = await self.sample_questions(quiz_category_id, difficulty, previous_questions, count or 1,
+                                                    rng, fields)
+
+        if count is not None:
+            return self.json({
+                "success": True,
+                "questions": format_rows(questions, fields)
+            })
+
+        return self.json({
+            "success": True,
+            "question": format_row(questions[0], fields) if questions else None
+        })
+
+    async def sample_questions(self, category_id, difficulty, previous_questions, count, rng, fields):
+        '''Same as sample_questions of the Flask app.'''
+        conditions, parameters = [], []
+        if category_id > 0:
+            conditions.append('category = ?')
+            parameters.append(category_id)
+        if difficulty is not None:
+            conditions.append('difficulty = ?')
+            parameters.append(difficulty)
+        if len(previous_questions) > 0:
+            conditions.append(f'id NOT IN ({", ".join("?" * len(previous_questions))})')
+            parameters.extend(previous_questions)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        total_questions, = await self.read_database.fetchone(f'SELECT COUNT(*) FROM questions{where}', *parameters)
+        offsets = rng.sample(range(total_questions), min(count, total_questions))
+        if not offsets:
+            return []
+
+        columns = ", ".join(fields)
+        if len(offsets) == 1:
+            rows = await self.read_database.fetch(
+                f'SELECT {columns} FROM questions{where} ORDER BY id LIMIT 1 OFFSET ?', *parameters, offsets[0])
+        else:
+            rows = await self.read_database.fetch(
+                f'SELECT {columns} FROM questions WHERE id IN (SELECT id FROM '
+                f'(SELECT id, ROW_NUMBER() OVER (ORDER BY id) - 1 AS position FROM questions{where}) AS numbered '
+                f'WHERE position IN ({", ".join("?" * len(offsets))})) ORDER BY id',
+                *parameters, *offsets)
+        if not rows:
+            # rows were deleted between the count and the fetch
+            rows = await self.read_database.fetch(f'SELECT {columns} FROM questions{where} ORDER BY id LIMIT ?',
+                                                  *parameters, len(offsets))
+        rows = [tuple(row) for row in rows]
+        if len(rows) != len(offsets):
+            return rows
+        rank = {offset: index for index, offset in enumerate(sorted(offsets))}
+        return [rows[rank[offset]] for offset in offsets]
+
+def create_asgi_app(test_config=None):
+    return ASGIApp(create_app(test_config))
@@ -0,0 +1,99 @@
+import zlib
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain')
+
+
+'''
+Compression
+    compresses responses with the preferred encoding of the
+    Accept-Encoding header of the request: brotli when the brotli
+    package is installed, gzip otherwise. Only 200 responses with a
+    compressible mimetype and a body of at least min_size bytes are
+    compressed. Streamed responses are compressed chunk by chunk and
+    flushed after every chunk, so clients keep receiving rows as they
+    are produced. Compressed responses get a weak ETag, since their
+    bytes differ from the identity response.
+'''
+class Compression:
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=4, encodings=('br', 'gzip')):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = [encoding for encoding in encodings if encoding != 'br' or brotli is not None]
+
+    def eligible(self, status, mimetype, size=None):
+        '''Whether a response may be compressed, size is None for a streamed body.'''
+        return (status == 200 and mimetype in COMPRESSIBLE_MIMETYPES
+                and (size is None or size >= self.min_size))
+
+    def negotiate(self, accept_encoding):
+        '''Returns the preferred accepted encoding, None for identity.'''
+        if not accept_encoding or not self.encodings:
+            return None
+        return parse_accept_header(accept_encoding).best_match(self.encodings)
+
+    def compress(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        # a gzip stream without a timestamp, the same body compresses to the same bytes
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+
+    def compress_stream(self, chunks, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+            compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+
+    def apply(self, request, response):
+        '''Compresses a Flask response in place for the request.'''
+        if 'Content-Encoding' in response.headers:
+            return response
+        size = None if response.is_streamed else response.calculate_content_length()
+        if not self.eligible(response.status_code, response.mimetype, size):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            # the compressed stream may be closed unstarted, close the original one too
+            if hasattr(response.response, 'close'):
+                response.call_on_close(response.response.close)
+            response.response = self.compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(self.compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def create_compression(config):
+    return Compression(
+        min_size=config.get('COMPRESSION_MIN_SIZE', 1024),
+        gzip_level=config.get('COMPRESSION_GZIP_LEVEL', 6),
+        brotli_quality=config.get('COMPRESSION_BROTLI_QUALITY', 4),
+        encodings=config.get('COMPRESSION_ENCODINGS', ('br', 'gzip')))
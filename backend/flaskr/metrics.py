@@ -0,0 +1,184 @@
+import threading
+import time
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def format_labels(names, values):
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+'''
+Counter
+    a Prometheus counter with one value per combination of label values
+'''
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, label_values)} {format_number(value)}')
+        return lines
+
+
+'''
+Histogram
+    a Prometheus histogram with cumulative buckets, a sum and a count per
+    combination of label values
+'''
+class Histogram:
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts, total, observations = self._values.get(label_values, ([0] * len(self.buckets), 0, 0))
+            counts = [count + (value <= bound) for count, bound in zip(counts, self.buckets)]
+            self._values[label_values] = (counts, total + value, observations + 1)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        bucket_labels = self.labels + ('le',)
+        with self._lock:
+            for label_values, (counts, total, observations) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    labels = format_labels(bucket_labels, label_values + (format_number(bound),))
+                    lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = format_labels(bucket_labels, label_values + ('+Inf',))
+                lines.append(f'{self.name}_bucket{labels} {observations}')
+                labels = format_labels(self.labels, label_values)
+                lines.append(f'{self.name}_sum{labels} {format_number(float(total))}')
+                lines.append(f'{self.name}_count{labels} {observations}')
+        return lines
+
+
+'''
+Metrics
+    request and SQL metrics of one application, per route. Statements that
+    take slow_query_seconds or longer are logged as warnings.
+'''
+class Metrics:
+
+    def __init__(self, slow_query_seconds=None):
+        self.slow_query_seconds = slow_query_seconds
+        self.requests = Counter(
+            'trivia_requests_total', 'Requests by route and status code.',
+            ('method', 'route', 'status'))
+        self.request_duration = Histogram(
+            'trivia_request_duration_seconds', 'Request latency by route.',
+            ('method', 'route'))
+        self.request_statements = Histogram(
+            'trivia_request_sql_statements', 'SQL statements issued per request by route.',
+            ('method', 'route'), STATEMENT_BUCKETS)
+        self.request_sql_duration = Histogram(
+            'trivia_request_sql_duration_seconds', 'Time spent in SQL statements per request by route.',
+            ('method', 'route'))
+        self.slow_queries = Counter(
+            'trivia_slow_queries_total', 'SQL statements slower than the slow query threshold.')
+        self.registered = []
+
+    def register(self, metric):
+        '''Adds a metric kept by another component to the exposition.'''
+        self.registered.append(metric)
+
+    def start_request(self):
+        g.request_start = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    def finish_request(self, request, response):
+        start = g.get('request_start')
+        if start is None:
+            return
+
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        self.observe_request(request.method, route, response.status_code, time.perf_counter() - start,
+                             g.sql_statements, g.sql_seconds)
+
+    def observe_request(self, method, route, status, seconds, sql_statements, sql_seconds):
+        self.requests.inc(method, route, status)
+        self.request_duration.observe(seconds, method, route)
+        self.request_statements.observe(sql_statements, method, route)
+        self.request_sql_duration.observe(sql_seconds, method, route)
+
+    def observe_statement(self, statement, seconds):
+        if 'sql_statements' in g:
+            g.sql_statements += 1
+            g.sql_seconds += seconds
+        self.check_slow_query(statement, seconds, current_app.logger)
+
+    def check_slow_query(self, statement, seconds, logger):
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            self.slow_queries.inc()
+            logger.warning('slow query (%.3fs): %s', seconds, statement)
+
+    def expose(self):
+        lines = []
+        for metric in [self.requests, self.request_duration, self.request_statements,
+                       self.request_sql_duration, self.slow_queries] + self.registered:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+'''
+SQLAlchemy listeners, for every engine: they time each statement and
+report it to the metrics of the current application, if any.
+'''
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('statement_start')
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+
+    if has_app_context():
+        metrics = current_app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.observe_statement(statement, seconds)
+
+
+@event.listens_for(Engine, 'handle_error')
+def handle_error(context):
+    starts = context.connection.info.get('statement_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
@@ -0,0 +1,186 @@
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+QUIZ_SESSION_BACKENDS = ('memory', 'redis')
+
+
+'''
+QuizSession
+    the question ids of one quiz, shuffled lazily: every call to next_id
+    swaps a random remaining id into place (one Fisher-Yates step), so a
+    quiz step is O(1) and starting a session never shuffles the whole list.
+'''
+class QuizSession:
+
+    def __init__(self, question_ids, rng=random):
+        self.question_ids = list(question_ids)
+        self.position = 0
+        self.rng = rng
+        self.last_used = None
+
+    def next_id(self):
+        if self.position >= len(self.question_ids):
+            return None
+
+        ids = self.question_ids
+        swap = self.rng.randrange(self.position, len(ids))
+        ids[self.position], ids[swap] = ids[swap], ids[self.position]
+        self.position += 1
+        return ids[self.position - 1]
+
+    @property
+    def remaining(self):
+        return len(self.question_ids) - self.position
+
+
+'''
+QuizSessionStore
+    in-memory quiz sessions keyed by an opaque session id. Sessions that
+    were not used for `ttl` seconds are evicted, and the least recently
+    used sessions are evicted once there are more than `max_sessions` or
+    they hold more than `max_question_ids` ids in total. Every process
+    has its own sessions, so with several workers the requests of a
+    session must be routed to the worker that started it.
+'''
+class QuizSessionStore:
+
+    def __init__(self, ttl=1800, max_sessions=10000, max_question_ids=1000000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_question_ids = max_question_ids
+        self.clock = clock
+        self._sessions = OrderedDict()
+        self._question_ids = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def start(self, question_ids):
+        session = QuizSession(question_ids)
+        session_id = secrets.token_urlsafe(16)
+
+        with self._lock:
+            now = self.clock()
+            self._evict_expired(now)
+            session.last_used = now
+            self._sessions[session_id] = session
+            self._question_ids += len(session.question_ids)
+            # always keep the session that was just started
+            while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or
+                                               self._question_ids > self.max_question_ids):
+                self._pop_oldest()
+
+        return session_id
+
+    def next_id(self, session_id):
+        '''
+        Returns the next question id of the session, None once the session
+        is exhausted. Raises KeyError for unknown or expired sessions.
+        '''
+        with self._lock:
+            now = self.clock()
+            self._evict_expired(now)
+            session = self._sessions[session_id]
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            return session.next_id()
+
+    def end(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return False
+            self._question_ids -= len(session.question_ids)
+            return True
+
+    def _pop_oldest(self):
+        _, session = self._sessions.popitem(last=False)
+        self._question_ids -= len(session.question_ids)
+
+    def _evict_expired(self, now):
+        # sessions are kept in least recently used order
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used < self.ttl:
+                break
+            self._pop_oldest()
+
+
+'''
+RedisQuizSessionStore
+    quiz sessions shared by every worker through a Redis-compatible
+    server: a session is a list of its ids, shuffled when it starts and
+    popped one by one, next to a marker that tells an exhausted session
+    from an unknown one. Both expire after `ttl` seconds without use;
+    the server's memory limit caps how many sessions are kept.
+'''
+class RedisQuizSessionStore:
+
+    # returns false for unknown sessions, 0 once the session is exhausted
+    NEXT = '''
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return false
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[1])
+    return redis.call('LPOP', KEYS[2]) or 0
+    '''
+
+    def __init__(self, url, ttl=1800, prefix='trivia:', rng=random):
+        if redis is None:
+            raise RuntimeError('QUIZ_SESSION_BACKEND redis needs the redis package: pip install redis')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.rng = rng
+        self._next = self.client.register_script(self.NEXT)
+
+    def _keys(self, session_id):
+        key = self.prefix + 'quiz:' + session_id
+        return [key, key + ':ids']
+
+    def start(self, question_ids):
+        question_ids = list(question_ids)
+        self.rng.shuffle(question_ids)
+        session_id = secrets.token_urlsafe(16)
+        marker, ids = self._keys(session_id)
+
+        pipeline = self.client.pipeline()
+        pipeline.set(marker, len(question_ids), ex=self.ttl)
+        if question_ids:
+            pipeline.rpush(ids, *question_ids)
+            pipeline.expire(ids, self.ttl)
+        pipeline.execute()
+        return session_id
+
+    def next_id(self, session_id):
+        '''Same as QuizSessionStore.next_id.'''
+        question_id = self._next(keys=self._keys(session_id), args=[self.ttl])
+        if question_id is None:
+            raise KeyError(session_id)
+        return int(question_id) or None
+
+    def end(self, session_id):
+        return self.client.delete(*self._keys(session_id)) > 0
+
+
+def create_quiz_session_store(config):
+    '''Returns the quiz session store chosen by QUIZ_SESSION_BACKEND.'''
+    name = config.get('QUIZ_SESSION_BACKEND', 'memory')
+    ttl = config.get('QUIZ_SESSION_TTL', 1800)
+    if name == 'memory':
+        return QuizSessionStore(ttl=ttl,
+                                max_sessions=config.get('QUIZ_SESSION_MAX_SESSIONS', 10000),
+                                max_question_ids=config.get('QUIZ_SESSION_MAX_QUESTION_IDS', 1000000))
+    if name == 'redis':
+        return RedisQuizSessionStore(config.get('QUIZ_SESSION_URL', 'redis://localhost:6379/0'), ttl=ttl)
+    raise ValueError(f'QUIZ_SESSION_BACKEND must be one of {QUIZ_SESSION_BACKENDS}, not {name!r}')
@@ -0,0 +1,198 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import Counter
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+RATE_LIMIT_BACKENDS = ('memory', 'redis')
+# the expensive routes, shed first under load
+LOAD_SHED_ROUTES = ('/quizzes', '/questions/search')
+
+
+def take_token(tokens, updated_at, now, rate, burst):
+    '''
+    Refills a token bucket of at most `burst` tokens by `rate` tokens per
+    second since updated_at and takes a token from it. Returns the tokens
+    left and the seconds until a token is available, 0 when one was taken.
+    '''
+    tokens = min(burst, tokens + max(now - updated_at, 0) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+def client_key(remote_addr, forwarded_for=None, trusted_proxies=1):
+    '''
+    The client of a request: with a forwarded header, the address the
+    first of the trusted_proxies proxies in front of the app appended to
+    it, counted from the right. The entries left of it are sent by the
+    client and can't be trusted. The peer address otherwise, or when the
+    header has fewer entries than there are proxies.
+    '''
+    if forwarded_for:
+        addresses = forwarded_for.split(',')
+        if 0 < trusted_proxies <= len(addresses):
+            return addresses[-trusted_proxies].strip()
+    return remote_addr or ''
+
+
+'''
+MemoryBackend
+    token buckets in the memory of the process, for at most max_keys
+    clients and routes: the least recently seen are dropped first, their
+    buckets were most likely full again.
+'''
+class MemoryBackend:
+
+    blocking = False
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, rate, burst):
+        '''Takes a token from the bucket of key, returns the seconds to wait for one, 0 when taken.'''
+        with self._lock:
+            now = self.clock()
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens, wait = take_token(tokens, updated_at, now, rate, burst)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+'''
+RedisBackend
+    token buckets shared by every worker through a Redis-compatible
+    server, usually one on the same host: a bucket is a hash updated by
+    a Lua script, so concurrent workers never take the same token.
+    Buckets expire once they would be full again.
+'''
+class RedisBackend:
+
+    blocking = True
+
+    # same as take_token
+    TAKE = '''
+    local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+    local tokens = tonumber(bucket[1]) or burst
+    local updated_at = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(now - updated_at, 0) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    '''
+
+    def __init__(self, url, prefix='trivia:', clock=time.time):
+        if redis is None:
+            raise RuntimeError('RATE_LIMIT_BACKEND redis needs the redis package: pip install redis')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.clock = clock
+        self._take = self.client.register_script(self.TAKE)
+
+    def take(self, key, rate, burst):
+        return float(self._take(keys=[self.prefix + 'bucket:' + key], args=[rate, burst, self.clock()]))
+
+
+'''
+RateLimiter
+    per-client token bucket limits of routes: limits maps a route rule to
+    (rate, burst), the requests per second a client may send on average
+    and at once. Routes without a limit aren't limited. Rejected requests
+    are counted per route.
+'''
+class RateLimiter:
+
+    def __init__(self, limits, backend):
+        for rule, (rate, burst) in limits.items():
+            if rate <= 0 or burst < 1:
+                raise ValueError(f'RATE_LIMITS of {rule} must have a rate above 0 and a burst of at least 1, '
+                                 f'not {(rate, burst)!r}')
+        self.limits = dict(limits)
+        self.backend = backend
+        self.rejected = Counter('trivia_rate_limited_total', 'Requests rejected by the rate limiter by route.', ('route',))
+
+    def limits_route(self, rule):
+        return rule in self.limits
+
+    def check(self, rule, client):
+        '''Returns the seconds the client has to wait before calling the route, 0 when the request may go on.'''
+        limit = self.limits.get(rule)
+        if limit is None:
+            return 0
+        rate, burst = limit
+        wait = self.backend.take(f'{rule}|{client}', rate, burst)
+        if wait:
+            self.rejected.inc(rule)
+        return wait
+
+
+'''
+LoadShedder
+    caps the requests of the routes it covers running at once in the
+    process: past max_concurrent, requests are turned away at once
+    instead of queueing for a database connection until they time out.
+    None doesn't cap them. Shed requests are counted per route.
+'''
+class LoadShedder:
+
+    def __init__(self, max_concurrent=None, routes=LOAD_SHED_ROUTES):
+        self.max_concurrent = max_concurrent
+        self.routes = tuple(routes)
+        self.in_flight = 0
+        self.shed = Counter('trivia_shed_requests_total', 'Requests shed under load by route.', ('route',))
+        self._lock = threading.Lock()
+
+    def covers(self, rule):
+        return self.max_concurrent is not None and rule in self.routes
+
+    def acquire(self, rule):
+        '''Takes a slot for a request to the route, False when it has to be shed.'''
+        with self._lock:
+            if self.in_flight >= self.max_concurrent:
+                shed = True
+            else:
+                self.in_flight += 1
+                shed = False
+        if shed:
+            self.shed.inc(rule)
+        return not shed
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+def create_rate_limiter(config):
+    '''Returns the rate limiter of RATE_LIMITS, on the backend chosen by RATE_LIMIT_BACKEND.'''
+    name = config.get('RATE_LIMIT_BACKEND', 'memory')
+    if name == 'memory':
+        backend = MemoryBackend(max_keys=config.get('RATE_LIMIT_MAX_CLIENTS', 100000))
+    elif name == 'redis':
+        backend = RedisBackend(config.get('RATE_LIMIT_URL', 'redis://localhost:6379/0'))
+    else:
+        raise ValueError(f'RATE_LIMIT_BACKEND must be one of {RATE_LIMIT_BACKENDS}, not {name!r}')
+    return RateLimiter(config.get('RATE_LIMITS', {}), backend)
+
+
+def create_load_shedder(config):
+    return LoadShedder(config.get('LOAD_SHED_MAX_CONCURRENT'), config.get('LOAD_SHED_ROUTES', LOAD_SHED_ROUTES))
@@ -0,0 +1,226 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+
+from .metrics import Counter
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+RESPONSE_CACHE_BACKENDS = ('lru', 'redis', 'none')
+
+# generation of every cached response, moved by writes that bypass the
+# per-question listeners (bulk imports)
+EPOCH = 'epoch'
+# generation of the responses that list questions of every category
+ALL_CATEGORIES = 'all'
+
+
+def category_generation(category_id):
+    return f'category:{category_id}'
+
+
+'''
+LRUBackend
+    in-process cache of at most max_bytes of response bodies, least
+    recently used first out. Entries older than ttl seconds are misses.
+'''
+class LRUBackend:
+
+    blocking = False
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=None, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, stored_at = item
+            if self.ttl is not None and self.clock() - stored_at >= self.ttl:
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        size = len(entry[2])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (entry, self.clock())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def generations(self, names):
+        with self._lock:
+            return [self._generations.get(name, 0) for name in names]
+
+    def bump(self, names):
+        with self._lock:
+            for name in names:
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+    def _pop(self, key):
+        (entry, _) = self._entries.pop(key)
+        self._bytes -= len(entry[2])
+
+
+'''
+RedisBackend
+    cache shared by every process through a Redis-compatible server: the
+    generations are counters on the server, so a write in one process
+    invalidates the responses cached by all of them. Entries expire after
+    ttl seconds.
+'''
+class RedisBackend:
+
+    blocking = True
+
+    def __init__(self, url, ttl=None, prefix='trivia:'):
+        if redis is None:
+            raise RuntimeError('RESPONSE_CACHE_BACKEND redis needs the redis package: pip install redis')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + 'response:' + key)
+        if value is None:
+            return None
+        etag, mimetype, body = value.split(b'\n', 2)
+        return etag.decode(), mimetype.decode(), body
+
+    def set(self, key, entry):
+        etag, mimetype, body = entry
+        value = f'{etag}\n{mimetype}\n'.encode() + body
+        self.client.set(self.prefix + 'response:' + key, value, ex=self.ttl)
+
+    def generations(self, names):
+        values = self.client.mget([self.prefix + 'generation:' + name for name in names])
+        return [int(value) if value is not None else 0 for value in values]
+
+    def bump(self, names):
+        pipeline = self.client.pipeline()
+        for name in names:
+            pipeline.incr(self.prefix + 'generation:' + name)
+        pipeline.execute()
+
+
+'''
+ResponseCache
+    caches the bodies of GET responses by route, view arguments and
+    query arguments. Every cached response depends on generations: the
+    epoch and the generation of the categories it lists. As a question
+    listener it moves the generations of the category of every added or
+    deleted question, so only the responses listing that category (or
+    every category) miss afterwards. Entries carry the ETag of their body
+    for conditional requests. Hits and misses are counted per route.
+    A None backend caches nothing.
+'''
+class ResponseCache:
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.requests = Counter(
+            'trivia_response_cache_requests_total', 'Response cache lookups by route and result.',
+            ('route', 'result'))
+
+    def key(self, rule, view_args, args, generations, vary=None):
+        '''
+        Returns the cache key of a response. args are the query
+        arguments as (name, value) pairs, vary an extra string the
+        response depends on.
+        '''
+        generations = [EPOCH] + list(generations)
+        parts = [rule, repr(sorted(view_args.items())), repr(sorted(args)),
+                 repr(list(zip(generations, self.backend.generations(generations)))), vary or '']
+        return hashlib.sha1('\0'.join(parts).encode()).hexdigest()
+
+    def get(self, rule, key):
+        entry = self.backend.get(key)
+        self.requests.inc(rule, 'hit' if entry is not None else 'miss')
+        return entry
+
+    def set(self, key, mimetype, body):
+        entry = (hashlib.sha1(body).hexdigest(), mimetype, body)
+        self.backend.set(key, entry)
+        return entry
+
+    def cached(self, generations, vary=None):
+        '''
+        Decorates a Flask view returning JSON: 200 responses are cached
+        and every response is made conditional on its ETag. generations
+        maps the view arguments to the generations of the response.
+        '''
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**view_args):
+                if self.backend is None:
+                    return view(**view_args)
+
+                rule = request.url_rule.rule
+                # read the generations before the view reads the database
+                key = self.key(rule, view_args, request.args.items(multi=True),
+                               generations(**view_args), vary() if vary is not None else None)
+                entry = self.get(rule, key)
+                if entry is None:
+                    response = view(**view_args)
+                    if response.status_code != 200:
+                        return response
+                    entry = self.set(key, response.mimetype, response.get_data())
+
+                etag, mimetype, body = entry
+                response = current_app.response_class(body, mimetype=mimetype)
+                response.set_etag(etag)
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+    def question_inserted(self, question):
+        self.invalidate([category_generation(question.category), ALL_CATEGORIES])
+
+    def question_deleted(self, question):
+        self.invalidate([category_generation(question.category), ALL_CATEGORIES])
+
+    def questions_changed(self):
+        self.invalidate([EPOCH])
+
+    def invalidate(self, generations):
+        if self.backend is not None:
+            self.backend.bump(generations)
+
+
+def create_backend(config):
+    '''
+    Returns the backend chosen by RESPONSE_CACHE_BACKEND, None when
+    responses aren't cached, which is the default.
+    '''
+    name = config.get('RESPONSE_CACHE_BACKEND', 'none')
+    ttl = config.get('RESPONSE_CACHE_TTL', 60)
+    if name == 'lru':
+        return LRUBackend(max_bytes=config.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024), ttl=ttl)
+    if name == 'redis':
+        return RedisBackend(config.get('RESPONSE_CACHE_URL', 'redis://localhost:6379/0'), ttl=ttl)
+    if name == 'none':
+        return None
+    raise ValueError(f'RESPONSE_CACHE_BACKEND must be one of {RESPONSE_CACHE_BACKENDS}, not {name!r}')
@@ -0,0 +1,134 @@
+from sqlalchemy import text
+
+'''
+Versioned schema migrations.
+
+Every migration has a version, a description and the SQL statements to
+run, per dialect ('default' is used when the dialect has no entry). The
+applied versions are recorded in the schema_migrations table, so
+upgrade() only runs the missing ones and can be re-run at any time. Each
+migration runs in its own transaction; on PostgreSQL an advisory lock
+keeps concurrent upgrades (several workers booting at once) from
+applying the same migration twice.
+
+Keep the models in models.py in line with the latest migration.
+'''
+MIGRATIONS_LOCK_ID = 44044
+
+MIGRATIONS = [
+    (1, 'create categories and questions', {
+        'postgresql': [
+            'CREATE TABLE IF NOT EXISTS categories (id SERIAL PRIMARY KEY, type VARCHAR)',
+            'CREATE TABLE IF NOT EXISTS questions (id SERIAL PRIMARY KEY, question VARCHAR, answer VARCHAR, '
+            'category INTEGER, difficulty INTEGER)',
+        ],
+        'default': [
+            'CREATE TABLE IF NOT EXISTS categories (id INTEGER PRIMARY KEY, type VARCHAR)',
+            'CREATE TABLE IF NOT EXISTS questions (id INTEGER PRIMARY KEY, question VARCHAR, answer VARCHAR, '
+            'category INTEGER, difficulty INTEGER)',
+        ],
+    }),
+    (2, 'reference categories from questions', {
+        # databases restored from trivia.psql already have such a constraint
+        'postgresql': [
+            'DO $$ BEGIN '
+            'IF NOT EXISTS (SELECT 1 FROM pg_constraint c JOIN pg_attribute a '
+            "ON a.attrelid = c.conrelid AND a.attnum = ANY (c.conkey) WHERE c.conrelid = 'questions'::regclass "
+            "AND c.contype = 'f' AND a.attname = 'category') THEN "
+            'ALTER TABLE questions ADD CONSTRAINT fk_questions_category FOREIGN KEY (category) '
+            'REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL; '
+            'END IF; END $$',
+        ],
+        # SQLite can't add a constraint to an existing table, rebuild it
+        'default': [
+            'CREATE TABLE questions_new (id INTEGER PRIMARY KEY, question VARCHAR, answer VARCHAR, '
+            'category INTEGER REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL, difficulty INTEGER)',
+            'INSERT INTO questions_new (id, question, answer, category, difficulty) '
+            'SELECT id, question, answer, category, difficulty FROM questions',
+            'DROP TABLE questions',
+            'ALTER TABLE questions_new RENAME TO questions',
+        ],
+    }),
+    (3, 'index questions by category and by difficulty', {
+        'default': [
+            'CREATE INDEX IF NOT EXISTS ix_questions_category_id ON questions (category, id)',
+            'CREATE INDEX IF NOT EXISTS ix_questions_difficulty ON questions (difficulty)',
+        ],
+    }),
+    (4, 'index question text for search', {
+        'postgresql': [
+            "CREATE INDEX IF NOT EXISTS ix_questions_question_tsv ON questions "
+            "USING gin (to_tsvector('simple', question))",
+            # creating the extension needs privileges the app's role may not
+            # have, substring searches then run unindexed
+            'DO $$ BEGIN '
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm; '
+            'CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON questions USING gin (question gin_trgm_ops); '
+            'EXCEPTION WHEN insufficient_privilege OR undefined_file OR feature_not_supported THEN '
+            "RAISE WARNING USING MESSAGE = 'pg_trgm is not available, substring search is not indexed: ' || SQLERRM; "
+            'END $$',
+        ],
+        # other databases search with the in-process indexes of search.py
+        'default': [],
+    }),
+    # the app moves the counter once per transaction, see
+    # bump_question_version in models.py; writes made outside the app
+    # have to move it themselves
+    (5, 'count writes to questions', {
+        'postgresql': [
+            'CREATE TABLE IF NOT EXISTS data_versions (name VARCHAR PRIMARY KEY, version BIGINT NOT NULL)',
+            "INSERT INTO data_versions (name, version) VALUES ('questions', 0) ON CONFLICT DO NOTHING",
+        ],
+        'default': [
+            'CREATE TABLE IF NOT EXISTS data_versions (name VARCHAR PRIMARY KEY, version INTEGER NOT NULL)',
+            "INSERT OR IGNORE INTO data_versions (name, version) VALUES ('questions', 0)",
+        ],
+    }),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def ensure_migrations_table(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, description VARCHAR)'))
+
+
+def applied_versions(connection):
+    return {version for version, in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def current_version(engine):
+    '''Returns the latest applied version, 0 for an empty database.'''
+    with engine.begin() as connection:
+        ensure_migrations_table(connection)
+        return max(applied_versions(connection), default=0)
+
+
+def upgrade(engine, target=None):
+    '''
+    Applies the migrations missing up to target (the latest by default)
+    and returns the versions that were applied.
+    '''
+    target = LATEST_VERSION if target is None else target
+    dialect = engine.dialect.name
+    applied = []
+
+    with engine.begin() as connection:
+        ensure_migrations_table(connection)
+
+    for version, description, statements in MIGRATIONS:
+        if version > target:
+            break
+        with engine.begin() as connection:
+            if dialect == 'postgresql':
+                connection.execute(text('SELECT pg_advisory_xact_lock(:id)'), id=MIGRATIONS_LOCK_ID)
+            if version in applied_versions(connection):
+                continue
+            for statement in statements.get(dialect, statements['default']):
+                connection.execute(text(statement))
+            connection.execute(text('INSERT INTO schema_migrations (version, description) VALUES (:version, :description)'),
+                               version=version, description=description)
+        applied.append(version)
+
+    return applied
@@ -1,23 +1,378 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import hashlib
+import threading
+import time
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, column, create_engine, event, func, orm, table, text, true
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import InvalidRequestError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
+from migrations import upgrade
+
 database_name = "udacity"
-database_path = "postgres://{}/{}".format('localhost:5432', database_name)
+database_path = os.environ.get('DATABASE_URL', "postgres://{}/{}".format('localhost:5432', database_name))
+
+'''
+RoutingSession
+    session that sends the reads of a session marked with
+    info['use_replica'] to a read replica (see ReplicaSet), the same one
+    for the whole session. Once the session writes, it goes back to the
+    primary for the rest of its life, so a request reads its own writes.
+    set_read_only() turns it into the session of a request that only
+    reads; a session created while g.read_only_session holds its
+    arguments starts read-only.
+'''
+class RoutingSession(SignallingSession):
+
+  def __init__(self, db, **options):
+    super().__init__(db, **options)
+    read_only = g.get('read_only_session') if has_app_context() else None
+    if read_only is not None:
+      self.set_read_only(**read_only)
+
+  def set_read_only(self, use_replica=False):
+    '''
+    Marks the session read-only: it doesn't autoflush, doesn't expire
+    what it loaded on commit and raises InvalidRequestError on a write.
+    With use_replica its reads go to a read replica.
+    '''
+    self.autoflush = False
+    self.expire_on_commit = False
+    self.info['read_only'] = True
+    self.info['use_replica'] = use_replica
+
+  def get_bind(self, mapper=None, clause=None):
+    writes = self._flushing or isinstance(clause, UpdateBase)
+    if writes and self.info.get('read_only'):
+      raise InvalidRequestError('the session is read-only')
+    if self.info.get('use_replica'):
+      if writes:
+        self.info['use_replica'] = False
+      else:
+        if 'replica' not in self.info:
+          replicas = self.app.extensions.get('replicas')
+          self.info['replica'] = replicas.choose() if replicas is not None else None
+        if self.info['replica'] is not None:
+          return self.info['replica']
+    return super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+db = RoutingSQLAlchemy()
+
+'''
+Engine settings, read from the app config and else from the environment:
+    DATABASE_POOL_MODE          `queue` (default) keeps a pool of connections
+                                in each process, `null` opens a connection per
+                                checkout for use behind an external pooler
+                                like PgBouncer
+    DATABASE_POOL_SIZE          connections kept in the pool
+    DATABASE_MAX_OVERFLOW       connections opened beyond the pool size
+    DATABASE_POOL_TIMEOUT       seconds to wait for a connection
+    DATABASE_POOL_RECYCLE       seconds after which connections are replaced
+    DATABASE_POOL_PRE_PING      test connections on checkout
+    DATABASE_STATEMENT_TIMEOUT  PostgreSQL statement_timeout in milliseconds
+    DATABASE_STARTUP            when the missing migrations are applied:
+                                `lazy` (default) before the first request, so
+                                workers boot without reaching the database,
+                                `upgrade` in setup_db and `skip` never, for
+                                deployments that run `flask db-upgrade`
+    DATABASE_REPLICA_URLS       URLs of read replicas of the database, a list
+                                or a comma-separated string, see ReplicaSet
+    DATABASE_REPLICA_CHECK_SECONDS
+                                seconds between health checks of a replica
+DATABASE_ENGINE_OPTIONS in the app config is passed to create_engine as is,
+and so are the pool settings to the engines of the replicas.
+'''
+POOL_MODES = ('queue', 'null')
+STARTUP_MODES = ('lazy', 'upgrade', 'skip')
+POOL_SETTINGS = [
+    ('DATABASE_POOL_SIZE', 'pool_size', int),
+    ('DATABASE_MAX_OVERFLOW', 'max_overflow', int),
+    ('DATABASE_POOL_TIMEOUT', 'pool_timeout', float),
+    ('DATABASE_POOL_RECYCLE', 'pool_recycle', int),
+]
+
+def get_setting(config, name, type=str, default=None):
+    value = config.get(name, os.environ.get(name))
+    if value is None:
+        return default
+    if type is bool and isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return type(value)
+
+'''
+engine_options(config, database_path)
+    builds the create_engine options of the database from the engine settings
+'''
+def engine_options(config, database_path):
+    mode = get_setting(config, 'DATABASE_POOL_MODE', default='queue')
+    if mode not in POOL_MODES:
+        raise ValueError(f'DATABASE_POOL_MODE must be one of {POOL_MODES}, not {mode!r}')
+
+    options = {}
+    if mode == 'null':
+        options['poolclass'] = NullPool
+    else:
+        pool_options = {}
+        for name, option, type in POOL_SETTINGS:
+            value = get_setting(config, name, type)
+            if value is not None:
+                pool_options[option] = value
+        # SQLite files get no pool unless a pool size is set
+        if not database_path.startswith('sqlite') or 'pool_size' in pool_options:
+            options['poolclass'] = TimedQueuePool
+            options.update(pool_options)
+
+    pre_ping = get_setting(config, 'DATABASE_POOL_PRE_PING', bool)
+    if pre_ping is not None:
+        options['pool_pre_ping'] = pre_ping
+
+    statement_timeout = get_setting(config, 'DATABASE_STATEMENT_TIMEOUT', int)
+    if statement_timeout is not None and database_path.startswith('postgres'):
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+
+    options.update(config.get('DATABASE_ENGINE_OPTIONS', {}))
+    return options
 
-db = SQLAlchemy()
+def replica_urls(config):
+    urls = config.get('DATABASE_REPLICA_URLS', os.environ.get('DATABASE_REPLICA_URLS', ''))
+    if isinstance(urls, str):
+        urls = urls.split(',')
+    return [url.strip() for url in urls if url.strip()]
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. The engine is
+    created on first use; only the `upgrade` startup mode connects here.
 '''
 def setup_db(app, database_path=database_path):
+    startup = get_setting(app.config, 'DATABASE_STARTUP', default='lazy')
+    if startup not in STARTUP_MODES:
+        raise ValueError(f'DATABASE_STARTUP must be one of {STARTUP_MODES}, not {startup!r}')
+
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config, database_path)
     db.app = app
     db.init_app(app)
-    db.create_all()
+    app.extensions['schema'] = {'ready': startup != 'lazy', 'lock': threading.Lock()}
+    if startup == 'upgrade':
+        upgrade(db.get_engine(app))
+    app.extensions['category_cache'] = CategoryCache(ttl=app.config.get('CATEGORY_CACHE_TTL'))
+    urls = replica_urls(app.config)
+    app.extensions['replicas'] = ReplicaSet(
+        urls, app.config, check_seconds=get_setting(app.config, 'DATABASE_REPLICA_CHECK_SECONDS', float, 10)) if urls else None
+
+'''
+ensure_schema()
+    applies the missing migrations once per application in the `lazy`
+    startup mode. A failed attempt, e.g. while the database is
+    unreachable, is retried on the next call.
+'''
+def ensure_schema():
+    app = db.get_app()
+    schema = app.extensions['schema']
+    if schema['ready']:
+        return
+    with schema['lock']:
+        if not schema['ready']:
+            upgrade(db.get_engine(app))
+            schema['ready'] = True
+
+'''
+TimedQueuePool
+    QueuePool that also records how many checkouts had to wait for a
+    connection, how long they waited and how many timed out
+'''
+class TimedQueuePool(QueuePool):
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.checkouts = 0
+    self.wait_seconds = 0.0
+    self.max_wait_seconds = 0.0
+    self.timeouts = 0
+    self._metrics_lock = threading.Lock()
+
+  def _do_get(self):
+    start = time.perf_counter()
+    timed_out = False
+    try:
+      return super()._do_get()
+    except PoolTimeoutError:
+      timed_out = True
+      raise
+    finally:
+      waited = time.perf_counter() - start
+      with self._metrics_lock:
+        self.checkouts += 1
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.timeouts += timed_out
+
+'''
+pool_status(engine)
+    returns the state of the connection pool of the engine
+'''
+def pool_status(engine):
+    pool = engine.pool
+    status = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        status.update({
+            'checkouts': pool.checkouts,
+            'wait_seconds': round(pool.wait_seconds, 6),
+            'max_wait_seconds': round(pool.max_wait_seconds, 6),
+            'timeouts': pool.timeouts,
+        })
+    return status
+
+'''
+ReplicaSet
+    the engines of the read replicas of the database, handed out
+    round-robin by choose() among the healthy ones. A replica is healthy
+    when it answers a query on schema_migrations: it is checked on first
+    use and then at most once every check_seconds, and marked down at
+    once when one of its connections is lost. choose() returns None,
+    i.e. the primary, while no replica is healthy.
+'''
+class ReplicaSet:
+
+  def __init__(self, urls, config, check_seconds=10, clock=time.monotonic):
+    self.urls = list(urls)
+    self.engines = [create_engine(url, **engine_options(config, url)) for url in self.urls]
+    self.check_seconds = check_seconds
+    self.clock = clock
+    self._healthy = [False] * len(self.urls)
+    self._checked_at = [None] * len(self.urls)
+    self._next = 0
+    self._lock = threading.Lock()
+    for index, engine in enumerate(self.engines):
+      event.listen(engine, 'handle_error', lambda context, index=index: self._handle_error(index, context))
+
+  def __len__(self):
+    return len(self.engines)
+
+  def choose(self, check=True):
+    '''
+    Returns the engine of the next healthy replica, None when there is
+    none. Checks the replicas that are due first, unless check is False
+    (callers that can't block on the database run check_due() elsewhere).
+    '''
+    if check:
+      self.check_due()
+    with self._lock:
+      for _ in range(len(self.engines)):
+        index = self._next
+        self._next = (index + 1) % len(self.engines)
+        if self._healthy[index]:
+          return self.engines[index]
+    return None
+
+  def due(self):
+    '''Whether a replica has to be checked.'''
+    now = self.clock()
+    with self._lock:
+      return any(checked_at is None or now - checked_at >= self.check_seconds for checked_at in self._checked_at)
+
+  def check_due(self):
+    now = self.clock()
+    for index in range(len(self.engines)):
+      with self._lock:
+        checked_at = self._checked_at[index]
+        if checked_at is not None and now - checked_at < self.check_seconds:
+          continue
+        # claimed, concurrent callers skip it
+        self._checked_at[index] = now
+      self.check(index)
+
+  def check(self, index):
+    try:
+      with self.engines[index].connect() as connection:
+        connection.execute(text('SELECT MAX(version) FROM schema_migrations')).scalar()
+      healthy = True
+    except Exception:
+      healthy = False
+    with self._lock:
+      self._healthy[index] = healthy
+      self._checked_at[index] = self.clock()
+
+  def status(self):
+    with self._lock:
+      healthy = list(self._healthy)
+    return [{'url': repr(make_url(url)), 'healthy': healthy[index], 'pool': pool_status(engine)}
+            for index, (url, engine) in enumerate(zip(self.urls, self.engines))]
+
+  def _handle_error(self, index, context):
+    if context.is_disconnect:
+      with self._lock:
+        self._healthy[index] = False
+        self._checked_at[index] = self.clock()
+
+'''
+get_category_cache()
+    returns the category cache of the current application
+'''
+def get_category_cache():
+    return db.get_app().extensions['category_cache']
+
+'''
+get_question_listeners()
+    returns the objects of the current application notified after a
+    question is committed: question_inserted(question) after
+    Question.insert, question_deleted(question) after Question.delete
+    and questions_changed() after writes that bypass both, like bulk imports
+'''
+def get_question_listeners():
+    return db.get_app().extensions.setdefault('question_listeners', [])
+
+def notify_questions_changed():
+    for listener in get_question_listeners():
+        listener.questions_changed()
+
+'''
+The app counts its writes to the questions table in the 'questions' row
+of data_versions, once per transaction: processes compare the counter
+with the one of their in-memory copies of the questions to find the
+writes of the others. The counter is moved right before the commit, on
+PostgreSQL its row stays locked until then.
+'''
+data_versions = table('data_versions', column('name'), column('version'))
+
+def question_version():
+    '''Returns the write counter of the questions table.'''
+    return db.session.execute(text("SELECT version FROM data_versions WHERE name = 'questions'")).scalar()
+
+def bump_question_version():
+    '''
+    Moves the write counter of the questions table in the current
+    transaction and returns its new value. The value is also kept in the
+    info of the session as written_question_version() for the listeners
+    notified after the commit.
+    '''
+    db.session.execute(data_versions.update().where(data_versions.c.name == 'questions')
+                       .values(version=data_versions.c.version + 1))
+    version = question_version()
+    db.session.info['question_version'] = version
+    return version
+
+def written_question_version():
+    '''Returns the write counter as moved by the last write of the session, None before any.'''
+    return db.session.info.get('question_version')
 
 '''
 Question
@@ -25,11 +380,15 @@ Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  __table_args__ = (
+    Index('ix_questions_category_id', 'category', 'id'),
+    Index('ix_questions_difficulty', 'difficulty'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(Integer)
+  category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
 
   def __init__(self, question, answer, category, difficulty):
@@ -40,14 +399,51 @@ class Question(db.Model):
 
   def insert(self):
     db.session.add(self)
+    db.session.flush()
+    bump_question_version()
     db.session.commit()
+    for listener in get_question_listeners():
+      listener.question_inserted(self)
   
   def update(self):
+    db.session.flush()
+    bump_question_version()
     db.session.commit()
 
   def delete(self):
+    # load the columns now, the listeners read them once the row is gone
+    self.id
     db.session.delete(self)
+    db.session.flush()
+    bump_question_version()
+    db.session.commit()
+    for listener in get_question_listeners():
+      listener.question_deleted(self)
+
+  @classmethod
+  def delete_by_id(cls, question_id):
+    '''
+    Deletes a question without loading it first: a single DELETE ...
+    RETURNING where the database has it, a SELECT and a DELETE
+    otherwise. Notifies the listeners like delete() and returns the
+    deleted (id, question, answer, category, difficulty) row, None when
+    there is no such question.
+    '''
+    dialect = db.session.get_bind(cls.__mapper__).dialect
+    if dialect.name == 'postgresql' or (dialect.name == 'sqlite' and dialect.dbapi.sqlite_version_info >= (3, 35)):
+      row = db.session.execute(DELETE_QUESTION_RETURNING, {'id': question_id}).first()
+    else:
+      table = cls.__table__
+      row = db.session.execute(table.select().where(table.c.id == question_id)).first()
+      if row is not None and db.session.execute(table.delete().where(table.c.id == question_id)).rowcount == 0:
+        row = None
+    if row is not None:
+      bump_question_version()
     db.session.commit()
+    if row is not None:
+      for listener in get_question_listeners():
+        listener.question_deleted(row)
+    return row
 
   def format(self):
     return {
@@ -58,6 +454,9 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+DELETE_QUESTION_RETURNING = text(
+  'DELETE FROM questions WHERE id = :id RETURNING id, question, answer, category, difficulty')
+
 '''
 Category
 
@@ -74,9 +473,140 @@ class Category(db.Model):
   def insert(self):
     db.session.add(self)
     db.session.commit()
+    get_category_cache().invalidate()
 
   def format(self):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+CategoryCache
+    keeps the {id: type} mapping of the categories in memory, with an
+    ETag of its content. It is reloaded after invalidate() (called by
+    Category.insert) or, when a ttl in seconds is given, once it expires.
+    cached() and store() let callers that can't use the session, like the
+    ASGI app, load the categories themselves.
+'''
+class CategoryCache:
+
+  def __init__(self, ttl=None, clock=time.monotonic):
+    self.ttl = ttl
+    self.clock = clock
+    self._categories = None
+    self._etag = None
+    self._loaded_at = None
+    self._lock = threading.Lock()
+
+  def get(self):
+    with self._lock:
+      if self._stale():
+        self._store(dict(db.session.query(Category.id, Category.type).order_by(Category.id)))
+      return self._categories, self._etag
+
+  def cached(self):
+    '''Returns the cached (categories, etag), None when they have to be loaded.'''
+    with self._lock:
+      return None if self._stale() else (self._categories, self._etag)
+
+  def store(self, categories):
+    with self._lock:
+      self._store(categories)
+      return self._categories, self._etag
+
+  def invalidate(self):
+    with self._lock:
+      self._categories = None
+
+  def _stale(self):
+    return self._categories is None or (self.ttl is not None and self.clock() - self._loaded_at >= self.ttl)
+
+  def _store(self, categories):
+    content = json.dumps(sorted(categories.items())).encode()
+    self._categories = categories
+    self._etag = hashlib.sha1(content).hexdigest()
+    self._loaded_at = self.clock()
+
+'''
+QuestionCounter
+    keeps the number of questions of every category and difficulty in
+    memory as a question listener: they are counted once with a single
+    GROUP BY, along with the write counter of the questions table, and
+    then moved by every Question.insert and Question.delete whose write
+    is the next one after the counts. A write the counts already hold is
+    skipped, and after a write they miss they are recounted. They are
+    also recounted after questions_changed() (bulk imports), or when the
+    write counter has moved, which is checked at most once every
+    check_seconds and picks up the writes of other processes.
+'''
+class QuestionCounter:
+
+  def __init__(self, check_seconds=5, clock=time.monotonic):
+    self.check_seconds = check_seconds
+    self.clock = clock
+    self._counts = None
+    self._total = None
+    self._version = None
+    self._checked_at = None
+    self._lock = threading.Lock()
+
+  def total(self):
+    with self._lock:
+      self._count()
+      return self._total
+
+  def counts(self):
+    '''Returns the {(category, difficulty): number of questions} of the categories and difficulties in use.'''
+    with self._lock:
+      self._count()
+      return dict(self._counts)
+
+  def question_inserted(self, question):
+    self._move(question, 1)
+
+  def question_deleted(self, question):
+    self._move(question, -1)
+
+  def questions_changed(self):
+    with self._lock:
+      self._counts = None
+
+  def _move(self, question, step):
+    version = written_question_version()
+    with self._lock:
+      if self._counts is None:
+        return
+      if version is None or self._version is None or version > self._version + 1:
+        # other writes were committed in between
+        self._counts = None
+        return
+      if version <= self._version:
+        # a recount made after the commit already counted the write
+        return
+      key = (question.category, question.difficulty)
+      count = self._counts.get(key, 0) + step
+      if count > 0:
+        self._counts[key] = count
+      else:
+        self._counts.pop(key, None)
+      self._total += step
+      self._version = version
+
+  def _count(self):
+    if self._counts is None:
+      self._recount()
+    elif self.clock() - self._checked_at >= self.check_seconds:
+      self._checked_at = self.clock()
+      if question_version() != self._version:
+        self._recount()
+
+  def _recount(self):
+    # one statement, so the counts and the write counter are read at once
+    rows = db.session.query(data_versions.c.version, Question.category, Question.difficulty, func.count(Question.id)) \
+      .select_from(data_versions).outerjoin(Question, true()).filter(data_versions.c.name == 'questions') \
+      .group_by(data_versions.c.version, Question.category, Question.difficulty).all()
+    self._counts = {(category, difficulty): count for _, category, difficulty, count in rows if count > 0}
+    self._total = sum(self._counts.values())
+    self._version = rows[0][0] if rows else None
+    self._checked_at = self.clock()
@@ -0,0 +1,289 @@
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import func, desc
+
+from models import db, question_version, Question
+from serialization import QUESTION_FIELDS, question_query
+
+'''
+Match modes of POST /questions/search:
+    substring   the search term is a substring of the question (ILIKE)
+    word        every word of the search term is a word of the question
+    prefix      every word of the search term starts a word of the question
+The word and prefix modes are ranked by relevance.
+'''
+SEARCH_MODES = ('substring', 'word', 'prefix')
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+'''
+InvertedIndex
+    in-process token index: postings map every token to the term
+    frequency of each question id that contains it, and a sorted
+    vocabulary answers prefix lookups with a binary search.
+'''
+class InvertedIndex:
+
+    def __init__(self):
+        self.postings = {}
+        self.documents = {}
+        self.vocabulary = []
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, question_id, text):
+        self.remove(question_id)
+        tokens = tokenize(text)
+        self.documents[question_id] = set(tokens)
+        for token in tokens:
+            if token not in self.postings:
+                self.postings[token] = {}
+                insort(self.vocabulary, token)
+            posting = self.postings[token]
+            posting[question_id] = posting.get(question_id, 0) + 1
+
+    def remove(self, question_id):
+        for token in self.documents.pop(question_id, ()):
+            posting = self.postings[token]
+            del posting[question_id]
+            if not posting:
+                del self.postings[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+    def expand(self, term, prefix):
+        if not prefix:
+            return [term] if term in self.postings else []
+
+        tokens = []
+        for index in range(bisect_left(self.vocabulary, term), len(self.vocabulary)):
+            token = self.vocabulary[index]
+            if not token.startswith(term):
+                break
+            tokens.append(token)
+        return tokens
+
+    def search(self, terms, prefix=False):
+        '''
+        Returns the ids of the questions matching every term, best match
+        first. A question scores the sum of tf * idf of its matching tokens;
+        ties are broken by id.
+        '''
+        if not terms:
+            return []
+
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for token in self.expand(term, prefix):
+                posting = self.postings[token]
+                idf = math.log(1 + len(self.documents) / len(posting))
+                for question_id, frequency in posting.items():
+                    term_scores[question_id] = term_scores.get(question_id, 0) + frequency * idf
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {question_id: score + term_scores[question_id]
+                          for question_id, score in scores.items() if question_id in term_scores}
+            if not scores:
+                return []
+
+        return sorted(scores, key=lambda question_id: (-scores[question_id], question_id))
+
+
+def trigrams(text):
+    return {text[index:index + 3] for index in range(len(text) - 2)}
+
+
+'''
+TrigramIndex
+    in-process substring index: postings map every trigram of the
+    lowercased question text to the ids containing it. A search intersects
+    the postings of the trigrams of the term, smallest first, and then
+    verifies the substring against the stored text of each candidate.
+'''
+class TrigramIndex:
+
+    def __init__(self):
+        self.postings = {}
+        self.texts = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, question_id, text):
+        self.remove(question_id)
+        text = (text or '').lower()
+        self.texts[question_id] = text
+        for trigram in trigrams(text):
+            self.postings.setdefault(trigram, set()).add(question_id)
+
+    def remove(self, question_id):
+        text = self.texts.pop(question_id, None)
+        if text is None:
+            return
+        for trigram in trigrams(text):
+            posting = self.postings[trigram]
+            posting.discard(question_id)
+            if not posting:
+                del self.postings[trigram]
+
+    def search(self, term):
+        '''
+        Returns the sorted ids of the questions containing the term, which
+        must be at least three characters long.
+        '''
+        term = term.lower()
+        postings = sorted((self.postings.get(trigram, set()) for trigram in trigrams(term)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                break
+        return sorted(question_id for question_id in candidates if term in self.texts[question_id])
+
+
+'''
+QuestionSearch
+    word and prefix search over the question text (and the answer text
+    when include_answers is set). On PostgreSQL the query runs against
+    to_tsvector/to_tsquery and is ranked with ts_rank; on other databases
+    an InvertedIndex is built on first use and kept up to date as a
+    question listener. Likewise a TrigramIndex answers substring searches
+    on other databases when use_trigrams is set; PostgreSQL serves them
+    with ILIKE, which a pg_trgm index speeds up. Like QuestionSnapshot,
+    the indexes are rebuilt when the write counter of the questions table
+    has moved past the one they were built at, which is checked at most
+    once every check_seconds: other processes and imports wrote.
+'''
+class QuestionSearch:
+
+    def __init__(self, include_answers=False, use_trigrams=True, check_seconds=5, clock=time.monotonic):
+        self.include_answers = include_answers
+        self.use_trigrams = use_trigrams
+        self.check_seconds = check_seconds
+        self.clock = clock
+        self._index = None
+        self._trigrams = None
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def substring_ids(self, term):
+        '''
+        Returns the sorted ids of the questions containing the term, or
+        None when the term has to be matched with ILIKE instead: on
+        PostgreSQL, for terms shorter than three characters and for terms
+        with LIKE wildcards.
+        '''
+        if (not self.use_trigrams or term is None or len(term) < 3 or '%' in term or '_' in term
+                or db.engine.dialect.name == 'postgresql'):
+            return None
+
+        with self._lock:
+            self._check()
+            if self._trigrams is None:
+                trigram_index = TrigramIndex()
+                for question_id, question in db.session.query(Question.id, Question.question):
+                    trigram_index.add(question_id, question)
+                self._trigrams = trigram_index
+            return self._trigrams.search(term)
+
+    def search(self, term, mode, offset, limit, fields=QUESTION_FIELDS):
+        '''
+        Returns the questions of the [offset, offset + limit) window of the
+        ranked matches, as tuples of their fields (which must include the
+        id), and the total number of matches.
+        '''
+        terms = tokenize(term)
+        if not terms:
+            return [], 0
+
+        if db.engine.dialect.name == 'postgresql':
+            return self._search_postgresql(terms, mode, offset, limit, fields)
+
+        with self._lock:
+            self._check()
+            if self._index is None:
+                self._build()
+            question_ids = self._index.search(terms, prefix=mode == 'prefix')
+
+        page_ids = question_ids[offset:offset + limit]
+        questions = {question.id: question for question in question_query(fields).filter(Question.id.in_(page_ids))}
+        return [questions[question_id] for question_id in page_ids if question_id in questions], len(question_ids)
+
+    def question_inserted(self, question):
+        with self._lock:
+            if self._index is not None:
+                self._index.add(question.id, self._text(question.question, question.answer))
+            if self._trigrams is not None:
+                self._trigrams.add(question.id, question.question)
+            self._follow()
+
+    def question_deleted(self, question):
+        with self._lock:
+            if self._index is not None:
+                self._index.remove(question.id)
+            if self._trigrams is not None:
+                self._trigrams.remove(question.id)
+            self._follow()
+
+    def questions_changed(self):
+        # rebuilt on next use
+        with self._lock:
+            self._index = None
+            self._trigrams = None
+
+    def _check(self):
+        if self._checked_at is not None and self.clock() - self._checked_at < self.check_seconds:
+            return
+        self._checked_at = self.clock()
+        # the counter is read before the rows the indexes are built from:
+        # a write committed meanwhile makes the next check rebuild them again
+        version = question_version()
+        if version != self._version:
+            self._index = None
+            self._trigrams = None
+            self._version = version
+
+    def _follow(self):
+        # the write just applied moved the counter by one, unless other
+        # processes wrote meanwhile: then the next check rebuilds
+        if self._version is not None and (self._index is not None or self._trigrams is not None):
+            version = question_version()
+            if version == self._version + 1:
+                self._version = version
+
+    def _text(self, question, answer):
+        if self.include_answers and answer:
+            return f'{question} {answer}'
+        return question
+
+    def _build(self):
+        index = InvertedIndex()
+        for question_id, question, answer in db.session.query(Question.id, Question.question, Question.answer):
+            index.add(question_id, self._text(question, answer))
+        self._index = index
+
+    def _search_postgresql(self, terms, mode, offset, limit, fields):
+        document = Question.question
+        if self.include_answers:
+            document = document + ' ' + func.coalesce(Question.answer, '')
+        document = func.to_tsvector('simple', document)
+
+        suffix = ':*' if mode == 'prefix' else ''
+        query = func.to_tsquery('simple', ' & '.join(term + suffix for term in terms))
+
+        selection = question_query(fields).filter(document.op('@@')(query))
+        total_questions = selection.count()
+        questions = selection.order_by(desc(func.ts_rank(document, query)), Question.id).offset(offset).limit(limit).all()
+        return questions, total_questions
@@ -0,0 +1,59 @@
+import json
+
+from models import db, Question
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+'''
+Serialization of the questions of the API responses.
+
+Questions are read as plain tuples of the columns a response needs,
+never as ORM instances, turned into dicts with the keys of
+Question.format() and encoded with orjson when it is installed (the
+stdlib encoder otherwise). The `fields` request argument lists the keys
+of a sparse response, e.g. `fields=question,answer`; the id is always
+included, cursors are made of it.
+'''
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+def parse_fields(value):
+    '''
+    Returns the fields named in a comma-separated `fields` argument, in
+    QUESTION_FIELDS order, and every field when value is None. Raises
+    ValueError on an unknown field.
+    '''
+    if value is None:
+        return QUESTION_FIELDS
+
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = names.difference(QUESTION_FIELDS)
+    if unknown:
+        raise ValueError(f'unknown question fields {sorted(unknown)}')
+    names.add('id')
+    return tuple(field for field in QUESTION_FIELDS if field in names)
+
+
+def question_query(fields=QUESTION_FIELDS):
+    '''Returns a query of the fields of the questions, as tuples.'''
+    return db.session.query(*[getattr(Question, field) for field in fields])
+
+
+def format_rows(rows, fields=QUESTION_FIELDS):
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def format_row(row, fields=QUESTION_FIELDS):
+    return dict(zip(fields, row)) if row is not None else None
+
+
+def dumps(data, sort_keys=True):
+    '''Encodes data as compact JSON bytes.'''
+    if orjson is not None:
+        # integer keys, as in the categories map, are written as strings like json.dumps does
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(data, option=option)
+    return json.dumps(data, sort_keys=sort_keys, separators=(',', ':')).encode()
@@ -0,0 +1,247 @@
+import random
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from models import db, question_version, Question
+
+# NULL category and difficulty in the typed arrays
+NULL = -2 ** 63
+EMPTY = array('q')
+
+
+def intern(text):
+    return sys.intern(text) if text is not None else None
+
+
+def nullable(value):
+    return None if value == NULL else value
+
+
+def contains(ids, question_id):
+    position = bisect_left(ids, question_id)
+    return position < len(ids) and ids[position] == question_id
+
+
+def skip(offset, skipped):
+    '''Returns the position of the offset-th id that isn't at one of the sorted skipped positions.'''
+    position = offset
+    for skipped_position in skipped:
+        if skipped_position > position:
+            break
+        position += 1
+    return position
+
+
+'''
+QuestionArrays
+    an immutable, array-backed copy of the questions table: ids,
+    categories and difficulties as typed arrays in id order, question and
+    answer texts interned, and the sorted ids of every category. Writes
+    return a new copy, so readers never need a lock; the ids of a
+    category and difficulty are kept once filtered.
+'''
+class QuestionArrays:
+
+    def __init__(self, ids, questions, answers, categories, difficulties, by_category):
+        self._ids = ids
+        self._questions = questions
+        self._answers = answers
+        self._categories = categories
+        self._difficulties = difficulties
+        self._by_category = by_category
+        self._filtered = {}
+
+    @classmethod
+    def load(cls, rows):
+        '''Builds the arrays from (id, question, answer, category, difficulty) rows in id order.'''
+        ids, categories, difficulties = array('q'), array('q'), array('q')
+        questions, answers = [], []
+        by_category = {}
+        for question_id, question, answer, category, difficulty in rows:
+            ids.append(question_id)
+            questions.append(intern(question))
+            answers.append(intern(answer))
+            categories.append(NULL if category is None else category)
+            difficulties.append(NULL if difficulty is None else difficulty)
+            by_category.setdefault(category, array('q')).append(question_id)
+        return cls(ids, questions, answers, categories, difficulties, by_category)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def ids(self, category=None):
+        '''Returns the sorted ids of the questions of the category, of all questions when None.'''
+        if category is None:
+            return self._ids
+        return self._by_category.get(category, EMPTY)
+
+    def candidates(self, category=None, difficulty=None):
+        '''Returns the sorted ids of the questions of the category and difficulty, None for any.'''
+        if difficulty is None:
+            return self.ids(category)
+        ids = self._filtered.get((category, difficulty))
+        if ids is None:
+            if category is None:
+                ids = array('q', (question_id for question_id, value in zip(self._ids, self._difficulties)
+                                  if value == difficulty))
+            else:
+                ids = array('q', (question_id for question_id in self.ids(category)
+                                  if self._difficulties[bisect_left(self._ids, question_id)] == difficulty))
+            self._filtered[(category, difficulty)] = ids
+        return ids
+
+    def rows(self, question_ids, fields):
+        '''Returns the tuples of the fields of the questions, skipping unknown ids.'''
+        columns = {'id': self._ids, 'question': self._questions, 'answer': self._answers,
+                   'category': self._categories, 'difficulty': self._difficulties}
+        columns = [columns[field] for field in fields]
+        rows = []
+        for question_id in question_ids:
+            position = bisect_left(self._ids, question_id)
+            if position < len(self._ids) and self._ids[position] == question_id:
+                rows.append(tuple(nullable(column[position]) for column in columns))
+        return rows
+
+    def page(self, category, after, page, limit):
+        '''
+        Returns the ids of a page of the questions of the category: the
+        `limit` ids following the id `after`, or those of page number
+        `page` when after is None. Also returns the number of questions of
+        the category and whether ids follow the page.
+        '''
+        ids = self.ids(category)
+        if after is not None:
+            start = bisect_right(ids, after)
+        else:
+            start = (page - 1) * limit
+            if page < 1 or start >= len(ids):
+                return [], len(ids), False
+        page_ids = ids[start:start + limit]
+        return page_ids, len(ids), start + len(page_ids) < len(ids)
+
+    def sample(self, category, difficulty, exclude, count, rng=random):
+        '''
+        Returns the ids of up to `count` distinct questions of the
+        category and difficulty (any when None) that are not in exclude,
+        drawn at random. The draws are offsets into the remaining ids in
+        id order, like sample_questions in the Flask app, so an rng seeded
+        the same way picks the same questions from the database.
+        '''
+        ids = self.candidates(category, difficulty)
+        skipped = sorted(bisect_left(ids, question_id) for question_id in set(exclude) if contains(ids, question_id))
+        remaining = len(ids) - len(skipped)
+        return [ids[skip(offset, skipped)] for offset in rng.sample(range(remaining), min(count, remaining))]
+
+    def inserted(self, row):
+        '''Returns a copy with the (id, question, answer, category, difficulty) row.'''
+        question_id, question, answer, category, difficulty = row
+        copy = self.deleted(question_id)
+        position = bisect_left(copy._ids, question_id)
+        ids = array('q', copy._ids)
+        ids.insert(position, question_id)
+        categories = array('q', copy._categories)
+        categories.insert(position, NULL if category is None else category)
+        difficulties = array('q', copy._difficulties)
+        difficulties.insert(position, NULL if difficulty is None else difficulty)
+        questions = list(copy._questions)
+        questions.insert(position, intern(question))
+        answers = list(copy._answers)
+        answers.insert(position, intern(answer))
+        by_category = dict(copy._by_category)
+        category_ids = array('q', by_category.get(category, EMPTY))
+        category_ids.insert(bisect_left(category_ids, question_id), question_id)
+        by_category[category] = category_ids
+        return QuestionArrays(ids, questions, answers, categories, difficulties, by_category)
+
+    def deleted(self, question_id):
+        '''Returns a copy without the question, self when it isn't there.'''
+        position = bisect_left(self._ids, question_id)
+        if position == len(self._ids) or self._ids[position] != question_id:
+            return self
+        category = nullable(self._categories[position])
+        by_category = dict(self._by_category)
+        category_ids = by_category[category]
+        index = bisect_left(category_ids, question_id)
+        by_category[category] = category_ids[:index] + category_ids[index + 1:]
+        return QuestionArrays(
+            self._ids[:position] + self._ids[position + 1:],
+            self._questions[:position] + self._questions[position + 1:],
+            self._answers[:position] + self._answers[position + 1:],
+            self._categories[:position] + self._categories[position + 1:],
+            self._difficulties[:position] + self._difficulties[position + 1:],
+            by_category)
+
+
+'''
+QuestionSnapshot
+    keeps QuestionArrays of the questions in memory for read-mostly
+    deployments, as a question listener: Question.insert and
+    Question.delete update it in place, questions_changed() reloads it.
+    Writes of other processes are found by comparing the write counter
+    of the questions table with the one of the snapshot, at most once
+    every check_seconds, and reload it.
+'''
+class QuestionSnapshot:
+
+    def __init__(self, check_seconds=5, clock=time.monotonic):
+        self.check_seconds = check_seconds
+        self.clock = clock
+        self._arrays = None
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def arrays(self):
+        '''Returns the current QuestionArrays, loading or checking them when due.'''
+        with self._lock:
+            if self._arrays is None:
+                self._load()
+            elif self.clock() - self._checked_at >= self.check_seconds:
+                self._checked_at = self.clock()
+                if question_version() != self._version:
+                    self._load()
+            return self._arrays
+
+    def cached(self):
+        '''Returns the current QuestionArrays, None when they have to be loaded or checked.'''
+        with self._lock:
+            if self._arrays is None or self.clock() - self._checked_at >= self.check_seconds:
+                return None
+            return self._arrays
+
+    def question_inserted(self, question):
+        with self._lock:
+            if self._arrays is not None:
+                self._arrays = self._arrays.inserted(
+                    (question.id, question.question, question.answer, question.category, question.difficulty))
+                self._follow()
+
+    def question_deleted(self, question):
+        with self._lock:
+            if self._arrays is not None:
+                self._arrays = self._arrays.deleted(question.id)
+                self._follow()
+
+    def questions_changed(self):
+        with self._lock:
+            self._arrays = None
+
+    def _follow(self):
+        # the write just applied moved the counter by one, unless other
+        # processes wrote meanwhile: then the next check reloads
+        version = question_version()
+        if version == self._version + 1:
+            self._version = version
+
+    def _load(self):
+        # the counter is read first: a write committed while the rows are
+        # read makes the next check reload them again
+        version = question_version()
+        rows = db.session.query(Question.id, Question.question, Question.answer, Question.category,
+                                Question.difficulty).order_by(Question.id)
+        self._arrays = QuestionArrays.load(rows)
+        self._version = version
+        self._checked_at = self.clock()
@@ -11,6 +11,7 @@ class QuizView extends Component {
     this.state = {
         quizCategory: null,
         previousQuestions: [], 
+        questions: [],
         showAnswer: false,
         categories: {},
         numCorrect: 0,
@@ -36,38 +37,31 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    this.setState({quizCategory: {type, id}}, this.getQuestions)
   }
 
   handleChange = (event) => {
     this.setState({[event.target.name]: event.target.value})
   }
 
-  getNextQuestion = () => {
-    const previousQuestions = [...this.state.previousQuestions]
-    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
-
+  // fetches the questions of the whole round in one request
+  getQuestions = () => {
     $.ajax({
       url: 'http://localhost:5000/quizzes', //DONE: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
+        previous_questions: this.state.previousQuestions,
+        quiz_category: this.state.quizCategory,
+        count: questionsPerPlay
       }),
       xhrFields: {
         withCredentials: false
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true
-        })
+        this.setState({questions: result.questions}, this.getNextQuestion)
         return;
       },
       error: (error) => {
@@ -77,6 +71,21 @@ class QuizView extends Component {
     })
   }
 
+  getNextQuestion = () => {
+    const previousQuestions = [...this.state.previousQuestions]
+    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
+    const [nextQuestion, ...questions] = this.state.questions
+
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      questions: questions,
+      currentQuestion: nextQuestion || {},
+      guess: '',
+      forceEnd: nextQuestion ? false : true
+    })
+  }
+
   submitGuess = (event) => {
     event.preventDefault();
     const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
@@ -91,6 +100,7 @@ class QuizView extends Component {
     this.setState({
       quizCategory: null,
       previousQuestions: [], 
+      questions: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},